@@ -9,7 +9,6 @@ import numpy as np
 import matplotlib.pyplot as plt
 import geoprobe
 
-from fault_kinematics.homogeneous_simple_shear import invert_slip
 import utilities
 import data
 
@@ -18,7 +17,7 @@ def main():
     plot_restored_locations(slips, heaves)
     plt.show()
 
-def restore_horizons(func=invert_slip):
+def restore_horizons(func=utilities.invert_slip):
     """
     Restore each of the uplifted horizons individually. 
 
@@ -31,11 +30,9 @@ def restore_horizons(func=invert_slip):
     variances, planar_variances = [], []
     slips, heaves = [], []
     for hor in data.horizons[::-1]:
-        hor_xyz = data.world_xyz(hor)
-
         # Downsample the horizon for faster runtime 
         # (No need to include millions of points along the horizon's surface)
-        hor_xyz = hor_xyz[::50]
+        hor_xyz = utilities.decimated_xyz(hor)
 
         # Invert for the slip along the fault needed to restore the horizon
         # to horizontal.
@@ -1,104 +1,606 @@
+"""
+Runs a parallel monte-carlo inversion to estimate both the amount of slip and
+the error in the estimate and stores the results in ``bootstrap.hdf5``.
+
+The work can be split across several machines by running a "shard" (a subset
+of the horizons and/or a range of run numbers) on each and combining the
+resulting files with ``merge_shards``. E.g.::
+
+    python bootstrap_error.py --seed 42 --runs 0 5000 -o shard1.hdf5
+    python bootstrap_error.py --seed 42 --runs 5000 10000 -o shard2.hdf5
+    python bootstrap_error.py --merge shard1.hdf5 shard2.hdf5 -o bootstrap.hdf5
+
+Every shard (i.e. any run with ``--horizons`` or ``--runs``) must be given the
+same explicit ``--seed`` and can't use ``--tol``, so that the shards can be
+merged.
+"""
+import os
 import numpy as np
 import multiprocessing
 import itertools
+import collections
+import traceback
+import zlib
+import Queue
+import argparse
 import h5py
 
 from fault_kinematics import homogeneous_simple_shear
 
-import sharedmem as shm
-
 import data
+import utilities
+import process_bootstrap_results
 
 
 class FakePool(object):
     """Mimics multiprocessing.Pool for debugging."""
+    def __init__(self, processes=None, initializer=None, initargs=()):
+        if initializer is not None:
+            initializer(*initargs)
     def map(self, func, args, chunksize):
         return map(func, args)
     def imap(self, func, args, chunksize):
         return itertools.imap(func, args)
+    def apply_async(self, func, args, callback=None):
+        result = func(*args)
+        if callback is not None:
+            callback(result)
+        return _FakeResult(result)
+    def close(self):
+        pass
+    def join(self):
+        pass
+
+class _FakeResult(object):
+    def __init__(self, value):
+        self.value = value
+    def get(self):
+        return self.value
+
+
+def main(filename='bootstrap.hdf5', numruns=200, numsamples=10000, tol=None,
+         minruns=50, seed=None, horizons=None, runs=None, checkevery=10):
+    """
+    Bootstraps the slip for each horizon and saves the results to `filename`.
+    Results are appended as each block of runs finishes, so rerunning after
+    an interruption picks up where the last run stopped.
 
+    If `tol` (in meters) is given, each horizon stops early once its mean slip
+    and 2-sigma error ellipse have converged (see ``ConvergenceMonitor``) and
+    `numruns` is only the maximum number of runs. Convergence is checked
+    every `checkevery` runs, so where a horizon stops doesn't depend on how
+    many cpus did the work. Horizons that converged under a different `tol`,
+    `minruns` or `checkevery` are checked again against their existing runs
+    and continued if they haven't converged under the new settings.
 
-def main():
-    fault = data.to_world(data.to_xyz(data.fault))
-    fault = shared_array(fault)
+    Run number `i` of a horizon always uses the same random stream (see
+    ``random_state``), derived from the root `seed` stored in `filename`. If
+    no seed is given, a random one is chosen the first time `filename` is
+    written. Files written by older versions of this script (without a seed)
+    can't be extended (see ``check_resumable``).
 
-    # Initalize output file...
-    output = h5py.File('bootstrap.hdf5', 'w')
-    group = output.create_group('IndependentBootstrap')
-    group.attrs['alpha'] = data.alpha
+    To write a shard, pass a list of horizon names as `horizons` and/or a
+    (start, stop) range of run numbers as `runs`. Shards must be given an
+    explicit `seed` (the same for all shards that will be merged) and can't
+    use `tol`.
+    """
+    if horizons is not None or runs is not None:
+        if seed is None or tol is not None:
+            raise ValueError('Shards need an explicit seed and a fixed '
+                             'number of runs (no tol).')
+    if horizons is not None:
+        unknown = set(horizons) - set(hor.name for hor in data.horizons)
+        if unknown:
+            raise ValueError('Unknown horizons: %s'
+                             % ', '.join(sorted(unknown)))
+    if runs is None:
+        runs = (0, numruns)
+    first_run, last_run = runs
 
-    pool = multiprocessing.Pool()
+    fault_key = data.array_hash(data.world_xyz(data.fault))
 
+    # Refuse files that can't be extended before doing any work...
+    if os.path.exists(filename):
+        existing = h5py.File(filename, 'r')
+        try:
+            if 'IndependentBootstrap' in existing:
+                check_resumable(existing['IndependentBootstrap'])
+        finally:
+            existing.close()
+
+    # Workers memory-map the fault and horizons from columnar stores, so all
+    # processes share the same (read-only) pages instead of each getting a
+    # copy...
+    faultpath = data.world_columns(data.fault)
+
+    # Start the workers before opening the output file so that they don't
+    # inherit its file handle.
+    pool = bootstrap_pool(faultpath)
+
+    # Initalize (or reopen) output file...
+    output = h5py.File(filename, 'a')
+    group = output.require_group('IndependentBootstrap')
+    require_attr(group, 'alpha', data.alpha)
+    require_attr(group, 'fault', fault_key)
+    seed = require_attr(group, 'seed', seed, new_seed)
+    print 'Root seed:', seed
+    numsamples = require_attr(group, 'numsamples', numsamples)
+
+    blocksize = last_run - first_run
+    blocksize = max(1, blocksize // (4 * multiprocessing.cpu_count()))
+
+    jobs = []
     for hor in data.horizons:
-        print hor.name
+        if horizons is not None and hor.name not in horizons:
+            continue
+        hor_group = require_results(group, hor.name, first_run)
+        hor_group.attrs['last_run'] = last_run
+        completed = hor_group.attrs['completed']
+        print hor.name, '(%i of %i runs complete)' % (completed, 
+                                                      last_run - first_run)
+        monitor = None
+        if tol is not None:
+            monitor = ConvergenceMonitor(tol, minruns, checkevery)
+            if (hor_group.attrs.get('converged', False) and
+                    monitor.params() == stored_convergence(hor_group)):
+                continue
+
+            # Replay the existing runs (e.g. if they were done without a tol
+            # or converged under different settings)
+            existing = (hor_group['slip'][:], hor_group['variance'][:])
+            converged = monitor.update(*existing) is not None
+            set_converged(hor_group, monitor if converged else None)
+            if converged:
+                continue
 
-        horxyz = data.to_world(data.to_xyz(hor))
-        # Use a shared array...
-        horxyz = shared_array(horxyz)
+        horpath = data.world_columns(hor)
+        jobs.append(HorizonJob(hor_group, horpath, last_run, blocksize, monitor))
 
-        # Run in parallel...
-        slip, var = parallel_bootstrap_slip(fault, horxyz, data.alpha, 
-                                pool=pool, numruns=200, numsamples=10000)
-        # Save results...
-        hor_group = group.create_group(hor.name)
-        hor_group.create_dataset('slip', data=slip)
-        hor_group.create_dataset('variance', data=var)
+    # Run all horizons through the pool at once, saving results as they
+    # finish...
+    run_jobs(pool, jobs, data.alpha, numsamples, seed, flush=output.flush)
 
+    # Save summary statistics for the figure scripts
+    process_bootstrap_results.write_summary(output)
     output.close()
+    pool.close()
+    pool.join()
+
+class HorizonJob(object):
+    """
+    The bootstrap runs that still need to be done for one horizon (up to run
+    number `numruns`). Blocks of runs may finish in any order, but are always
+    written to `hor_group` in order (and convergence is checked in order), so
+    the results don't depend on how the work was scheduled.
+    """
+    def __init__(self, hor_group, horpath, numruns, blocksize, monitor=None):
+        self.group = hor_group
+        self.name = hor_group.name.split('/')[-1]
+        self.horpath = horpath
+        self.monitor = monitor
+        self.first_run = hor_group.attrs['first_run']
+        self.next_run = self.first_run + hor_group.attrs['completed']
+        self.pending = blocks(numruns, blocksize, self.next_run)
+        self.finished = {}
+        self.done = False
+
+    def next_block(self):
+        """The (start, stop) of the next block to run or None if there isn't
+        one."""
+        if self.done:
+            return None
+        return next(self.pending, None)
+
+    def add(self, start, results):
+        """Stores a finished block and writes any blocks that are now in
+        order. Returns True if anything was written."""
+        if self.done:
+            return False
+        self.finished[start] = results
+        written = False
+        while self.next_run in self.finished and not self.done:
+            results = self.finished.pop(self.next_run)
+            self.write(results[:,:2], results[:,2])
+            written = True
+        return written
+
+    def write(self, slip, var):
+        converged_at = None
+        if self.monitor is not None:
+            converged_at = self.monitor.update(slip, var)
+        converged = converged_at is not None
+        if converged:
+            # Only keep the runs up to the check where it converged
+            keep = converged_at - self.group.attrs['completed']
+            slip, var = slip[:keep], var[:keep]
+
+        append_results(self.group, slip, var)
+        completed = self.group.attrs['completed']
+        self.next_run = self.first_run + completed
+        set_converged(self.group, self.monitor if converged else None)
+        if converged:
+            self.done = True
+            self.finished.clear()
+            print '%s converged after %i runs' % (self.name, completed)
+
+def run_jobs(pool, jobs, alpha, numsamples, seed, window=None, flush=None):
+    """
+    Runs the blocks of several ``HorizonJob``s through a single pool created
+    by ``bootstrap_pool``. Up to `window` blocks (by default, 2 per cpu) are
+    queued at once, taken from the first unfinished horizon, so workers move
+    on to the next horizon without waiting for the slowest runs of the
+    previous one. `flush` is called after results are written.
+    """
+    if window is None:
+        window = 2 * multiprocessing.cpu_count()
+
+    finished = Queue.Queue()
+    queued = 0
+    while True:
+        while queued < window:
+            task = _next_task(jobs)
+            if task is None:
+                break
+            i, (start, stop) = task
+            args = (jobs[i].horpath, jobs[i].name, alpha, numsamples, seed,
+                    start, stop)
+            pool.apply_async(_run_task, ((i, args),), callback=finished.put)
+            queued += 1
+        if queued == 0:
+            break
+
+        i, start, results = finished.get()
+        queued -= 1
+        if isinstance(results, basestring):
+            raise RuntimeError('Bootstrap block failed:\n' + results)
+        if jobs[i].add(start, results) and flush is not None:
+            flush()
+
+def _next_task(jobs):
+    for i, job in enumerate(jobs):
+        block = job.next_block()
+        if block is not None:
+            return i, block
+    return None
+
+def _run_task(task):
+    """Runs a block for ``run_jobs``. Returns the formatted traceback instead
+    of raising, as the pool would otherwise never call back."""
+    i, args = task
+    start = args[-2]
+    try:
+        results = _bootstrap_block(args)
+    except Exception:
+        results = traceback.format_exc()
+    return i, start, results
+
+def require_attr(group, name, value=None, default=None):
+    """
+    Returns the attribute `name` of `group`. If it isn't set yet, it's set to
+    `value` (or to ``default()`` if `value` is None). Raises a ValueError if
+    `value` is given and doesn't match the stored attribute.
+    """
+    if name not in group.attrs:
+        group.attrs[name] = default() if value is None else value
+    elif value is not None and group.attrs[name] != value:
+        raise ValueError('%s was run with %s=%s, not %s'
+                         % (group.file.filename, name, group.attrs[name], value))
+    return group.attrs[name]
+
+def new_seed():
+    """A random root seed for ``random_state``."""
+    return np.random.RandomState().randint(0, 2**31 - 1)
 
-def shared_array(arr):
-    shared = shm.empty(arr.shape, arr.dtype)
-    shared[:] = arr
-    return shared
+def random_state(seed, name, run):
+    """
+    The random number generator for bootstrap run number `run` of the
+    horizon called `name`. Every (seed, name, run) gets its own independent,
+    reproducible stream, regardless of which process or machine runs it.
+    """
+    key = zlib.crc32(name) & 0xffffffff
+    return np.random.RandomState([seed, key, run])
 
-def _invert_inclined_shear(args):
-    """Dummy function to work around multiprocessing.pool only accepting
-    one iterable argument and needing functions to be visible from __main__."""
-    args = list(args)
-    numsamples = args[-1]
-    args = args[:-1]
+def rerun(name, run, seed, numsamples=10000, alpha=None):
+    """
+    Regenerates a single bootstrap run (e.g. for debugging). Returns dx, dy,
+    and variance, which match run number `run` of the horizon called `name`
+    in a bootstrap.hdf5 file with the root seed `seed`.
+    """
+    if alpha is None:
+        alpha = data.alpha
+    hor = data.horizons[[item.name for item in data.horizons].index(name)]
+    horizon = data.open_store(data.world_columns(hor))
+    fault = data.open_store(data.world_columns(data.fault))
+    rng = random_state(seed, name, run)
+    return _invert_inclined_shear(fault, horizon, alpha, numsamples,
+                                  downdip_direction(), rng)
 
+def require_results(group, name, first_run=0):
+    """
+    Opens (or creates) the group of bootstrap results for a horizon. The
+    group holds consecutive runs starting at run number `first_run`. Any runs
+    written after the group's last "completed" count (e.g. if a run was
+    interrupted while saving) are discarded.
+    """
+    if name not in group:
+        hor_group = group.create_group(name)
+        hor_group.create_dataset('slip', shape=(0, 2), maxshape=(None, 2),
+                                 dtype=np.float64, chunks=(1024, 2))
+        hor_group.create_dataset('variance', shape=(0,), maxshape=(None,),
+                                 dtype=np.float64, chunks=(1024,))
+        hor_group.attrs['completed'] = 0
+        hor_group.attrs['first_run'] = first_run
+
+    hor_group = group[name]
+    check_resumable(group, [name])
+    require_attr(hor_group, 'first_run', first_run)
+
+    completed = hor_group.attrs['completed']
+    for dataset in [hor_group['slip'], hor_group['variance']]:
+        if dataset.shape[0] != completed:
+            dataset.resize(completed, axis=0)
+    return hor_group
+
+def check_resumable(group, names=None):
+    """
+    Raises a ValueError if any of the horizon groups `names` (by default, all
+    of them) in `group` can't be appended to. Older versions of this script
+    saved all runs at once in fixed-size datasets without a "completed"
+    count, or didn't record the seed and number of samples the runs were
+    made with (so they can't be regenerated with ``rerun``). New runs need
+    to go in a new file.
+    """
+    if names is None:
+        names = group.keys()
+    for name in names:
+        hor_group = group[name]
+        if ('completed' not in hor_group.attrs
+                or hor_group['slip'].chunks is None
+                or hor_group['variance'].chunks is None):
+            raise ValueError('%s: the results for %s were written by an older '
+                             'version of bootstrap_error.py and can\'t be '
+                             'extended. Write new runs to a new file.'
+                             % (group.file.filename, name))
+
+    has_runs = any(len(group[name]['variance']) for name in group)
+    for attr in ['seed', 'numsamples']:
+        if has_runs and attr not in group.attrs:
+            raise ValueError('%s: existing runs were saved without a %s and '
+                             'can\'t be extended. Write new runs to a new '
+                             'file.' % (group.file.filename, attr))
+
+def append_results(hor_group, slip, var):
+    """Appends bootstrap runs to a group created by ``require_results``."""
+    completed = hor_group.attrs['completed']
+    total = completed + len(var)
+    for name, values in [('slip', slip), ('variance', var)]:
+        dataset = hor_group[name]
+        dataset.resize(total, axis=0)
+        dataset[completed:total] = values
+
+    # Only count the runs once they've been written.
+    hor_group.attrs['completed'] = total
+
+class ConvergenceMonitor(object):
+    """
+    Tracks the mean and 2-sigma error ellipse of bootstrapped slips (after
+    removing outliers the same way as ``process_bootstrap_results``) and
+    decides when enough runs have been done. Convergence is checked after
+    every `checkevery` runs, regardless of how the runs are added.
+    """
+    def __init__(self, tol, minruns=50, checkevery=10):
+        """
+        Parameters:
+        -----------
+            tol : The bootstrap has converged once a check moves the mean
+                slip and changes the axes of the 2-sigma error ellipse by
+                less than `tol` (in meters) since the previous check.
+            minruns : The minimum number of runs before checking convergence.
+            checkevery : Check convergence after every `checkevery` runs.
+        """
+        self.tol = tol
+        self.minruns = minruns
+        self.checkevery = checkevery
+        self.slips, self.variances = [], []
+        self.checked = 0
+        self.previous = None
+
+    def params(self):
+        """The (tol, minruns, checkevery) that define convergence."""
+        return (float(self.tol), int(self.minruns), int(self.checkevery))
+
+    def update(self, slip, var):
+        """Adds a block of runs. Returns the total number of runs after which
+        the results converged, or None if they haven't converged yet."""
+        self.slips.append(slip)
+        self.variances.append(var)
+        var = np.hstack(self.variances)
+        slip = np.vstack(self.slips)
+
+        first = max(self.minruns, self.checked + 1)
+        first = -(-first // self.checkevery) * self.checkevery
+        for numruns in range(first, var.size + 1, self.checkevery):
+            if self._check(slip[:numruns], var[:numruns]):
+                return numruns
+        self.checked = var.size
+        return None
+
+    def _check(self, slip, var):
+        slip = slip[~utilities.is_outlier(var)]
+        mean = slip.mean(axis=0)
+        axes = 2 * np.sqrt(np.linalg.eigvalsh(np.cov(slip, rowvar=False)))
+        previous, self.previous = self.previous, (mean, axes)
+        if previous is None:
+            return False
+
+        mean_change = np.linalg.norm(mean - previous[0])
+        axes_change = np.abs(axes - previous[1]).max()
+        return mean_change < self.tol and axes_change < self.tol
+
+def set_converged(hor_group, monitor=None):
+    """Marks `hor_group` as converged under the settings of the
+    ``ConvergenceMonitor`` `monitor` (or as not converged if it's None)."""
+    hor_group.attrs['converged'] = monitor is not None
+    if monitor is not None:
+        hor_group.attrs['convergence'] = monitor.params()
+    elif 'convergence' in hor_group.attrs:
+        del hor_group.attrs['convergence']
+
+def stored_convergence(hor_group):
+    """The (tol, minruns, checkevery) that `hor_group` converged under (see
+    ``set_converged``), or None if they weren't recorded."""
+    if 'convergence' not in hor_group.attrs:
+        return None
+    tol, minruns, checkevery = hor_group.attrs['convergence']
+    return (float(tol), int(minruns), int(checkevery))
+
+def bootstrap_pool(faultpath, processes=None, poolclass=multiprocessing.Pool):
+    """
+    A process pool for ``run_jobs``. Each worker memory-maps the fault
+    geometry stored at `faultpath` (see ``data.world_columns``) once when it
+    starts and keeps it for every task.
+    """
+    return poolclass(processes, data.init_fault_worker, (faultpath,))
+
+def downdip_direction():
+    """Starting search directions for the inversion."""
     # "Nudge" solution down-dip (give it a starting direction of downdip)
     dipdir = np.radians(data.fault_strike + 90)
     dx, dy = np.cos(dipdir), np.sin(dipdir)
-    direc = np.array([[dx,0],[0,dy]], dtype=np.float)
+    return np.array([[dx,0],[0,dy]], dtype=np.float)
 
+def _bootstrap_block(args):
+    """
+    Runs the bootstrap inversions for runs `start` through `stop` in a worker
+    and returns them as a (stop - start)x3 array of dx, dy, variance. (Takes
+    a single tuple because pool.imap only passes one argument.)
+    """
+    horpath, name, alpha, numsamples, seed, start, stop = args
+    horizon = data.open_store(horpath)
+    fault = data.fault_columns()
+    direc = downdip_direction()
+
+    results = np.empty((stop - start, 3), dtype=np.float)
+    for i, run in enumerate(range(start, stop)):
+        rng = random_state(seed, name, run)
+        results[i] = _invert_inclined_shear(fault, horizon, alpha, numsamples,
+                                            direc, rng)
+    return results
+
+def _invert_inclined_shear(fault, horizon, alpha, numsamples, direc, rng):
+    """A single bootstrap inversion. `fault` and `horizon` are tuples of
+    x, y, z columns and `rng` is the run's ``random_state``."""
     # Randomly resample fault with replacement
-    args[0] = subsample(args[0])
+    fault_idx = subsample(len(fault[0]), rng=rng)
 
     # Randomly resample horizon (potentially not with replacement, depending 
     # on numsamples) (Horizon is over-sampled anwyay. It's okay to subsample)
-    args[1] = subsample(args[1], numsamples)
+    hor_idx = subsample(len(horizon[0]), numsamples, rng)
+
+    # Only copy the resampled points out of the shared arrays now.
+    fault = data.columns2xyz(fault, fault_idx)
+    hor = data.columns2xyz(horizon, hor_idx)
 
     kwargs = dict(direc=direc, return_metric=True, overlap_thresh=1)
-    (dx,dy), var = homogeneous_simple_shear.invert_slip(*args, **kwargs)
+    (dx,dy), var = homogeneous_simple_shear.invert_slip(fault, hor, alpha,
+                                                        **kwargs)
 
     return dx, dy, var
 
-def subsample(xyz, numsamples=None):
+def subsample(numpoints, numsamples=None, rng=np.random):
+    """Indices of `numsamples` points (by default, `numpoints`) drawn with
+    replacement from `numpoints` points."""
     if numsamples is None:
-        numsamples = xyz.shape[0]
-    numpoints = xyz.shape[0]
-    idx = np.random.randint(0, numpoints, numsamples)
-    return xyz[idx]
-
-def parallel_bootstrap_slip(faultxyz, horxyz, alpha, numruns=10000, 
-                            numsamples=None, pool=None):
-    if pool is None:
-        pool = multiprocessing.Pool()
-
-    # Work around pool.map only taking a single argument...
-    horizons = itertools.repeat(horxyz, numruns)
-    faults = itertools.repeat(faultxyz, numruns)
-    alphas = itertools.repeat(alpha, numruns)
-    numsamples = itertools.repeat(numsamples, numruns)
-    args = itertools.izip(faults, horizons, alphas, numsamples)
-
-    results = pool.map(_invert_inclined_shear, args, chunksize=1)
-    data = np.array(results, dtype=np.float)
-    slip = data[:,:2]
-    var = data[:,2]
-    return slip, var
+        numsamples = numpoints
+    return rng.randint(0, numpoints, numsamples)
+
+def blocks(numruns, blocksize, start=0):
+    """Yields (start, stop) indices of runs in blocks of `blocksize`."""
+    for i in range(start, numruns, blocksize):
+        yield i, min(i + blocksize, numruns)
+
+def merge_shards(filenames, output):
+    """
+    Combines shards written by ``main`` into a single file (`output`, which
+    must not exist yet) with the same layout as a full bootstrap. All shards
+    must have the same alpha, fault geometry, seed and number of samples, the
+    run ranges of each horizon must not overlap or leave gaps, and each shard
+    must have finished all of the runs it was started with.
+    """
+    shards = [h5py.File(name, 'r') for name in filenames]
+    try:
+        groups = [shard['IndependentBootstrap'] for shard in shards]
+        for name in ['alpha', 'fault', 'seed', 'numsamples']:
+            values = set(group.attrs[name] for group in groups)
+            if len(values) != 1:
+                raise ValueError('Shards have different values of %s: %s' 
+                                 % (name, sorted(values)))
+
+        pieces = collections.defaultdict(list)
+        for group in groups:
+            for name, hor_group in group.items():
+                pieces[name].append(hor_group)
+
+        merged = h5py.File(output, 'w-')
+        try:
+            out_group = merged.create_group('IndependentBootstrap')
+            for name, value in groups[0].attrs.items():
+                out_group.attrs[name] = value
+            for name in sorted(pieces):
+                _merge_horizon(require_results(out_group, name), pieces[name])
+            process_bootstrap_results.write_summary(merged)
+        except:
+            merged.close()
+            os.remove(output)
+            raise
+        merged.close()
+    finally:
+        for shard in shards:
+            shard.close()
+
+def _merge_horizon(out_hor, hor_groups):
+    """Appends the runs in `hor_groups` to `out_hor` in order of run number."""
+    hor_groups = sorted(hor_groups, key=lambda g: g.attrs['first_run'])
+    for hor_group in hor_groups:
+        expected = out_hor.attrs['completed']
+        first_run = hor_group.attrs['first_run']
+        if first_run != expected:
+            raise ValueError('%s: expected a shard starting at run %i, found '
+                             'one starting at %i' % (hor_group.name, expected,
+                                                     first_run))
+        completed = hor_group.attrs['completed']
+        last_run = hor_group.attrs.get('last_run')
+        if (last_run is not None and first_run + completed < last_run
+                and not hor_group.attrs.get('converged', False)):
+            raise ValueError('%s: the shard starting at run %i stopped after '
+                             '%i of %i runs' % (hor_group.name, first_run,
+                                                completed, last_run - first_run))
+        append_results(out_hor, hor_group['slip'][:completed],
+                       hor_group['variance'][:completed])
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description=__doc__,
+                        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-o', '--output', default='bootstrap.hdf5')
+    parser.add_argument('--numruns', type=int, default=200)
+    parser.add_argument('--numsamples', type=int, default=10000)
+    parser.add_argument('--tol', type=float, default=None,
+                        help='Stop each horizon once converged (meters)')
+    parser.add_argument('--checkevery', type=int, default=10,
+                        help='Check convergence every N runs (with --tol)')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--horizons', nargs='+', default=None, 
+                        help='Only run these horizons (shard)')
+    parser.add_argument('--runs', nargs=2, type=int, default=None, 
+                        metavar=('START', 'STOP'),
+                        help='Only do these run numbers (shard)')
+    parser.add_argument('--merge', nargs='+', metavar='SHARD',
+                        help='Merge shards into OUTPUT instead of running')
+    args = parser.parse_args()
+
+    if args.merge:
+        merge_shards(args.merge, args.output)
+    else:
+        main(args.output, args.numruns, args.numsamples, args.tol,
+             seed=args.seed, horizons=args.horizons, runs=args.runs,
+             checkevery=args.checkevery)
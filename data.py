@@ -1,4 +1,26 @@
+"""
+Locations of datafiles and transform utilities.
+
+The fault, seismic volume and horizons are only read from disk the first time
+they're accessed (e.g. ``data.fault`` or ``data.horizons``), so importing this
+module is cheap and a script only pays for the datasets it actually uses.
+
+World coordinates for datasets read from disk are cached as ``.npy`` files in
+``cachedir`` and memory-mapped on later runs (see ``world_xyz``). They can also
+be stored as separate x, y, and z columns (see ``world_columns``) that any
+process can memory-map without copying or pickling them.
+
+Model <--> world coordinate conversions use an affine transform extracted from
+the seismic volume once and saved to ``transformname``. After that, the volume
+file doesn't need to be present.
+"""
+import hashlib
+import json
 import os
+import shutil
+import sys
+import tempfile
+import types
 
 import geoprobe
 import numpy as np
@@ -6,12 +28,14 @@ import numpy as np
 basedir = os.path.dirname(__file__)
 basedir = os.path.join(basedir, 'data')
 
-faultname = os.path.join(basedir, 'swFaults', 
+faultname = os.path.join(basedir, 'swFaults',
                          'jdk_oos_splay_large_area_depth-mod.swf')
-fault = geoprobe.swfault(faultname)
 
 volname = os.path.join(basedir, 'Volumes', 'example.hdf')
-vol = geoprobe.volume(volname)
+transformname = os.path.join(basedir, 'Volumes', 'example_model2world.txt')
+
+# Converted world coordinates are cached here. Safe to delete at any time.
+cachedir = os.path.join(basedir, 'cache')
 
 # These are in stratigraphic order from oldest to youngest
 horizon_names = [
@@ -28,7 +52,6 @@ horizon_names = [
     ]
 
 horizon_names = [os.path.join(basedir, 'Horizons', item) for item in horizon_names]
-horizons = [geoprobe.horizon(item) for item in horizon_names]
 
 gulick_names = ['7', '6', '5', '4', '3.5', '3', '2.5', '2', '1.5', '1']
 
@@ -36,32 +59,386 @@ gulick_names = ['7', '6', '5', '4', '3.5', '3', '2.5', '2', '1.5', '1']
 alpha = 70
 
 
+def memoize(func):
+    """Caches the result of a function that takes no arguments."""
+    cache = []
+    def wrapper():
+        if not cache:
+            cache.append(func())
+        return cache[0]
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+# Maps id(obj) --> filename for datasets read by this module so that their
+# world coordinates can be cached. (The objects are memoized, so ids are
+# never reused.)
+_source_filenames = {}
+
+def _read(reader, filename):
+    obj = reader(filename)
+    _source_filenames[id(obj)] = filename
+    return obj
+
+@memoize
+def load_fault():
+    """The main (landward branch of the OOSTS) fault surface."""
+    return _read(geoprobe.swfault, faultname)
+
+@memoize
+def load_volume():
+    """The seismic volume used for model <--> world coordinate transforms."""
+    return geoprobe.volume(volname)
+
+@memoize
+def load_transform():
+    """
+    The volume's model <--> world coordinate transform. This is read from
+    ``transformname`` and is only extracted from the volume if that file is
+    missing or older than the volume.
+    """
+    if os.path.exists(transformname):
+        if not os.path.exists(volname):
+            return AffineTransform.load(transformname)
+        if os.path.getmtime(transformname) >= os.path.getmtime(volname):
+            return AffineTransform.load(transformname)
+    transform = AffineTransform.from_volume(load_volume())
+    transform.save(transformname)
+    return transform
+
+@memoize
+def load_horizons():
+    """The forearc horizons in stratigraphic order from oldest to youngest."""
+    return [_read(geoprobe.horizon, item) for item in horizon_names]
+
+@memoize
+def load_fault_xyz():
+    """An Nx3 array of the fault's points in world coordinates."""
+    return world_xyz(load_fault())
+
+@memoize
+def load_fault_strike_dip():
+    """The average strike and dip of the fault surface."""
+    return geoprobe.utilities.points2strikeDip(*load_fault_xyz().T)
+
+
 def to_xyz(hor):
     return np.vstack([hor.x, hor.y, hor.z]).T
 
 def xyz2hor(xyz):
     return geoprobe.horizon(*xyz.T)
 
-def to_world(points):
-    points = np.atleast_2d(points)
-    if points.shape[1] == 2:
-        return np.vstack(vol.model2world(*points.T)).T
-    else:
-        x, y, z = points.T
-        x, y = vol.model2world(x, y)
-        return np.vstack([x, y, -z]).T
-
-def to_model(points):
-    points = np.atleast_2d(points)
-    if points.shape[1] == 2:
-        return np.vstack(vol.world2model(*points.T)).T
-    else:
-        x, y, z = points.T
-        x, y = vol.world2model(x, y)
-        return np.vstack([x, y, -z]).T
+def to_world(points, out=None):
+    """
+    Converts an Nx2 or Nx3 array of model coordinates to world coordinates.
+    (Z-values are negated to convert depth to elevation.) Pass in
+    ``out=points`` to convert in place.
+    """
+    return load_transform().model2world(points, out)
+
+def to_model(points, out=None):
+    """Inverse of ``to_world``."""
+    return load_transform().world2model(points, out)
 
 def world_xyz(hor):
-    return to_world(to_xyz(hor))
+    """
+    An Nx3 array of the points in `hor` (a geoprobe horizon or swfault) in
+    world coordinates. If `hor` was read by this module, the result is cached
+    on disk and returned as a read-only memory-mapped array.
+    """
+    filename = _source_filenames.get(id(hor))
+    if filename is None:
+        return to_world(to_xyz(hor))
+    return cached_world_xyz(filename, lambda: to_world(to_xyz(hor)))
+
+def cached_world_xyz(filename, convert):
+    """
+    Returns the world coordinates of the dataset stored in `filename`, calling
+    `convert()` to calculate them if they aren't already cached. The cache is
+    keyed by the path, size and modification time of `filename` and by the
+    coordinate transform.
+    """
+    cachename = os.path.join(cachedir, _cache_key(filename) + '.npy')
+    if not os.path.exists(cachename):
+        save_atomic(cachename, convert())
+    return np.load(cachename, mmap_mode='r')
+
+def cached_derived(hor, name, compute):
+    """
+    An array derived from the points in `hor` (e.g. the indices of a subset of
+    them), cached on disk under `name` the same way as ``world_xyz``.
+    `compute()` is called to calculate it if it isn't cached yet (or if `hor`
+    wasn't read by this module).
+    """
+    filename = _source_filenames.get(id(hor))
+    if filename is None:
+        return compute()
+    cachename = os.path.join(cachedir, '%s-%s.npy' % (_cache_key(filename),
+                                                      name))
+    if not os.path.exists(cachename):
+        save_atomic(cachename, compute())
+    return np.load(cachename)
+
+def world_columns(hor):
+    """
+    Stores the world coordinates of `hor` in a columnar store (see
+    ``write_columns``) and returns its path. The path can be passed to other
+    processes, which can then use ``open_columns`` to access the points
+    without copying them. Stores are cached in ``cachedir``.
+    """
+    filename = _source_filenames.get(id(hor))
+    if filename is None:
+        xyz = world_xyz(hor)
+        key = array_hash(xyz)
+    else:
+        xyz = None
+        key = _cache_key(filename)
+
+    path = os.path.join(cachedir, key + '.cols')
+    if not os.path.exists(path):
+        if xyz is None:
+            xyz = world_xyz(hor)
+        write_columns(path, xyz)
+    return path
+
+def write_columns(path, xyz, dtype=np.float64):
+    """
+    Writes an Nx3 array of points to a columnar store. The store is a
+    directory containing a small json header and the x, y, and z coordinates
+    as separate, contiguous raw arrays of `dtype`. `xyz` may also be an
+    iterable of Nx3 arrays (e.g. from ``utilities.iter_grid_xyz``), which are
+    written one at a time.
+    """
+    chunks = [xyz] if isinstance(xyz, np.ndarray) else xyz
+    dtype = np.dtype(dtype)
+    tmpdir = _mkdtemp_beside(path)
+    try:
+        npoints = 0
+        files = [open(os.path.join(tmpdir, name), 'wb')
+                 for name in _column_names]
+        try:
+            for chunk in chunks:
+                chunk = np.asarray(chunk)
+                for outfile, column in zip(files, chunk.T):
+                    column.astype(dtype).tofile(outfile)
+                npoints += chunk.shape[0]
+        finally:
+            for outfile in files:
+                outfile.close()
+        header = dict(npoints=npoints, dtype=dtype.str,
+                      columns=_column_names)
+        with open(os.path.join(tmpdir, 'header'), 'w') as outfile:
+            json.dump(header, outfile)
+    except:
+        shutil.rmtree(tmpdir)
+        raise
+
+    try:
+        os.rename(tmpdir, path)
+    except OSError:
+        shutil.rmtree(tmpdir)
+        # Another process may have written the same store in the meantime
+        if not os.path.exists(os.path.join(path, 'header')):
+            raise
+
+def open_columns(path, mode='r'):
+    """
+    Opens a columnar store written by ``write_columns``. Returns a tuple of
+    x, y, z memory-mapped arrays (read-only by default).
+    """
+    with open(os.path.join(path, 'header'), 'r') as infile:
+        header = json.load(infile)
+    dtype = np.dtype(str(header['dtype']))
+    shape = (header['npoints'],)
+    if header['npoints'] == 0:
+        return tuple(np.empty(0, dtype) for name in header['columns'])
+    return tuple(np.memmap(os.path.join(path, name), dtype, mode, shape=shape)
+                 for name in header['columns'])
+
+def columns2xyz(columns, idx=None):
+    """Builds an Nx3 array from a tuple of x, y, z columns, optionally
+    selecting only the points at the indices in `idx`."""
+    if idx is not None:
+        columns = [col[idx] for col in columns]
+    return np.column_stack(columns)
+
+_column_names = ['x', 'y', 'z']
+
+# Columnar stores memory-mapped by this process (see ``open_store``)
+_stores = {}
+
+def open_store(path):
+    """Memory-maps the columnar store at `path` (only once per process)."""
+    if path not in _stores:
+        _stores[path] = open_columns(path)
+    return _stores[path]
+
+# The fault, memory-mapped in each worker process (see ``init_fault_worker``)
+_fault_worker = {}
+
+def init_fault_worker(faultpath):
+    """
+    A ``multiprocessing.Pool`` initializer that memory-maps the fault stored at
+    `faultpath` (see ``world_columns``) in each worker. Tasks then access it
+    with ``fault_columns``, so all workers share the same read-only pages
+    instead of each keeping a copy of the fault.
+    """
+    _fault_worker['fault'] = open_store(faultpath)
+
+def fault_columns():
+    """The x, y, z columns of the fault in a worker process started with
+    ``init_fault_worker``. Use ``columns2xyz`` to copy (some of) the points
+    into an Nx3 array."""
+    return _fault_worker['fault']
+
+def array_hash(arr):
+    """A hash of the contents of an array (e.g. to check that results were
+    computed with the same fault geometry)."""
+    return hashlib.md5(np.ascontiguousarray(arr).tobytes()).hexdigest()
+
+def fingerprint(*filenames):
+    """A hash of the absolute path, size and modification time of each file."""
+    md5 = hashlib.md5()
+    for filename in filenames:
+        filename = os.path.abspath(filename)
+        stat = os.stat(filename)
+        md5.update(repr((filename, stat.st_size, stat.st_mtime)).encode('utf-8'))
+    return md5.hexdigest()
+
+def _cache_key(filename):
+    """Cache key for the world coordinates of the dataset in `filename`."""
+    md5 = hashlib.md5(fingerprint(filename).encode('utf-8'))
+    md5.update(load_transform().matrix.tobytes())
+    return md5.hexdigest()
+
+def _makedirs(dirname):
+    if not os.path.exists(dirname):
+        try:
+            os.makedirs(dirname)
+        except OSError:
+            # Another process may have created it in the meantime
+            if not os.path.isdir(dirname):
+                raise
+
+def _mkdtemp_beside(path):
+    """A temporary directory on the same filesystem as `path` so that it can
+    be atomically renamed to `path`."""
+    dirname = os.path.dirname(path)
+    _makedirs(dirname)
+    return tempfile.mkdtemp(suffix='.tmp', dir=dirname)
+
+def save_atomic(filename, arr):
+    """Saves `arr` to `filename` so that other processes never see a partially
+    written file."""
+    dirname = os.path.dirname(filename)
+    _makedirs(dirname)
+    fd, tmpname = tempfile.mkstemp(suffix='.npy', dir=dirname)
+    try:
+        with os.fdopen(fd, 'wb') as outfile:
+            np.save(outfile, np.ascontiguousarray(arr))
+        os.rename(tmpname, filename)
+    except:
+        os.remove(tmpname)
+        raise
+
+
+class AffineTransform(object):
+    """
+    A 2D affine model --> world coordinate transform. `matrix` is a 2x3 array
+    such that ``world_xy = matrix[:,:2].dot(model_xy) + matrix[:,2]``.
+    """
+    # Number of points converted at once (bounds temporary memory use)
+    chunksize = 2**16
+
+    def __init__(self, matrix):
+        self.matrix = np.asarray(matrix, dtype=np.float64).reshape(2, 3)
+        rotation, offset = self.matrix[:,:2], self.matrix[:,2]
+        inv_rotation = np.linalg.inv(rotation)
+        self.inverse = np.hstack([inv_rotation, -inv_rotation.dot(offset)[:,None]])
+
+    @classmethod
+    def from_volume(cls, vol):
+        """Extracts the transform from a geoprobe volume."""
+        x = np.array([0, 1, 0], dtype=np.float64)
+        y = np.array([0, 0, 1], dtype=np.float64)
+        (x0, x1, x2), (y0, y1, y2) = vol.model2world(x, y)
+        return cls([[x1 - x0, x2 - x0, x0],
+                    [y1 - y0, y2 - y0, y0]])
+
+    @classmethod
+    def load(cls, filename):
+        return cls(np.loadtxt(filename))
+
+    def save(self, filename):
+        np.savetxt(filename, self.matrix, fmt='%.17g')
+
+    def model2world(self, points, out=None):
+        return self._apply(self.matrix, points, out)
+
+    def world2model(self, points, out=None):
+        return self._apply(self.inverse, points, out)
+
+    def _apply(self, matrix, points, out=None):
+        """
+        Transforms the x, y columns of an Nx2 or Nx3 array (negating z, if
+        present). The output has the same dtype as the input for floating
+        point arrays, but the math is always done in double precision.
+        `out` may be `points` to transform in place.
+        """
+        points = np.atleast_2d(points)
+        if out is None:
+            dtype = points.dtype
+            if not np.issubdtype(dtype, np.floating):
+                dtype = np.float64
+            out = np.empty(points.shape, dtype=dtype)
+
+        rotation, offset = matrix[:,:2], matrix[:,2]
+        for start in range(0, points.shape[0], self.chunksize):
+            chunk = slice(start, start + self.chunksize)
+            xy = np.dot(points[chunk,:2], rotation.T)
+            xy += offset
+            out[chunk,:2] = xy
+            if points.shape[1] == 3:
+                np.negative(points[chunk,2], out[chunk,2])
+        return out
+
+
+# Attributes of this module that are loaded on first access.
+_lazy_attributes = {
+    'fault': load_fault,
+    'vol': load_volume,
+    'transform': load_transform,
+    'horizons': load_horizons,
+    'fault_xyz': load_fault_xyz,
+    'fault_strike': lambda: load_fault_strike_dip()[0],
+    'fault_dip': lambda: load_fault_strike_dip()[1],
+    }
+
+class _LazyModule(types.ModuleType):
+    """
+    Stands in for this module in ``sys.modules`` so that the datasets in
+    ``_lazy_attributes`` are only read when they're first accessed.
+    (Python 2 doesn't support a module-level ``__getattr__``.)
+    """
+    def __init__(self, module):
+        types.ModuleType.__init__(self, module.__name__, module.__doc__)
+        self.__dict__.update(module.__dict__)
+        # Keep a reference to the original module. Otherwise its globals are
+        # cleared when it's garbage collected.
+        self._module = module
+
+    def __getattr__(self, name):
+        try:
+            loader = _lazy_attributes[name]
+        except KeyError:
+            raise AttributeError(name)
+        return loader()
+
+    def __setattr__(self, name, value):
+        # The functions in this module read the original module's globals,
+        # so settings such as ``cachedir`` have to be changed there too.
+        types.ModuleType.__setattr__(self, name, value)
+        if name != '_module':
+            setattr(self._module, name, value)
 
-fault_xyz = world_xyz(fault)
-fault_strike, fault_dip = geoprobe.utilities.points2strikeDip(*fault_xyz.T)
+sys.modules[__name__] = _LazyModule(sys.modules[__name__])
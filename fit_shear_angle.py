@@ -1,28 +1,20 @@
 import matplotlib.pyplot as plt
+import numpy as np
+import multiprocessing
 import sys
 
-from fault_kinematics.homogeneous_simple_shear import invert_slip
+import scipy.optimize
+
+import utilities
 import data
 
+alphas = range(-80, 85, 5)
+
 def optimize_single_alpha():
     """Find the single shear angle that best flattens all horizons using a grid
     search."""
-    fault = data.to_world(data.to_xyz(data.fault))
-    alphas = range(-80, 85, 5)
-
-    roughness = []
-    for alpha in alphas:
-        update('Alpha = %i: ' % alpha)
-
-        rough = 0
-        for i, hor in enumerate(data.horizons):
-            xyz = data.to_world(data.to_xyz(hor))[::50]
-            update('%i ' % (len(data.horizons) - i))
-            slip, metric = invert(fault, xyz, alpha)
-            rough += metric
-
-        update('\n')
-        roughness.append(rough)
+    slips, misfits = sweep()
+    roughness = misfits.sum(axis=0)
 
     fig, ax = plt.subplots()
     ax.plot(alphas, roughness)
@@ -36,21 +28,9 @@ def optimize_single_alpha():
 
 def optimize_individual_alpha():
     """Find the best shear angle for each horizon using a grid search."""
-    fault = data.to_world(data.to_xyz(data.fault))
-    alphas = range(-80, 85, 5)
-
-    for hor in data.horizons:
-        update(hor.name + ': ')
-        xyz = data.to_world(data.to_xyz(hor))[::50]
-
-        roughness = []
-        for i, alpha in enumerate(alphas):
-            update('%i ' % (len(alphas) - i)) 
-            slip, metric = invert(fault, xyz, alpha)
-            roughness.append(metric)
-
-        update('\n')
+    slips, misfits = sweep()
 
+    for hor, roughness in zip(data.horizons, misfits):
         fig, ax = plt.subplots()
         ax.plot(alphas, roughness)
         ax.set_title(hor.name)
@@ -60,12 +40,116 @@ def optimize_individual_alpha():
 
     plt.show()
 
-def invert(fault, xyz, alpha):
-    return invert_slip(fault, xyz, alpha, overlap_thresh=1, return_metric=True)
+def fit_single_alpha(bounds=(-80, 80), xtol=0.1):
+    """
+    Find the single shear angle that best flattens all horizons using Brent's
+    method (``scipy.optimize.fminbound``) between the shear angles in
+    `bounds`. At each trial shear angle the horizons are inverted in
+    parallel, starting from the slips found at the nearest angle already
+    evaluated.
+
+    Returns:
+    --------
+        best : The optimal shear angle in degrees.
+        curve : A dict of shear angle --> (slips, misfits) for every shear
+            angle evaluated, where slips is a len(horizons)x2 array and
+            misfits is a len(horizons) array.
+    """
+    faultpath = data.world_columns(data.fault)
+    horizons = [utilities.decimated_xyz(hor)
+                for hor in data.horizons]
+    pool = multiprocessing.Pool(None, data.init_fault_worker, (faultpath,))
+
+    curve = {}
+    def roughness(alpha):
+        alpha = float(alpha)
+        if alpha not in curve:
+            if curve:
+                nearest = min(curve, key=lambda item: abs(item - alpha))
+                guesses = curve[nearest][0]
+            else:
+                guesses = [(0, 0)] * len(horizons)
+            tasks = [(xyz, alpha, guess) for xyz, guess in zip(horizons, guesses)]
+            results = pool.map(_invert_task, tasks, chunksize=1)
+            slips, misfits = zip(*results)
+            curve[alpha] = np.array(slips), np.array(misfits)
+            update('Alpha = %0.2f: %0.2f\n' % (alpha, sum(misfits)))
+        return curve[alpha][1].sum()
+
+    best = scipy.optimize.fminbound(roughness, bounds[0], bounds[1],
+                                    xtol=xtol)
+    pool.close()
+    pool.join()
+
+    evaluated = sorted(curve)
+    update('Best alpha: %0.2f (%i evaluations)\n' % (best, len(evaluated)))
+
+    fig, ax = plt.subplots()
+    ax.plot(evaluated, [curve[alpha][1].sum() for alpha in evaluated], 'o-')
+    ax.axvline(best, color='gray', linestyle='--')
+    ax.set_title('Optimizing Shear Angle')
+    ax.set_ylabel('Summed misfit (m)')
+    ax.set_xlabel('Shear angle (degrees)')
+    fig.savefig('fit_single_alpha.pdf')
+
+    return best, curve
+
+@data.memoize
+def sweep():
+    """
+    Inverts each horizon for slip at each shear angle in ``alphas``. The
+    horizons are inverted in parallel, and each inversion starts from the
+    slip found for the same horizon at the previous shear angle.
+
+    Returns:
+    --------
+        slips : An array of slip vectors of shape (len(horizons), len(alphas), 2)
+        misfits : An array of misfits of shape (len(horizons), len(alphas))
+    """
+    faultpath = data.world_columns(data.fault)
+    horizons = [utilities.decimated_xyz(hor)
+                for hor in data.horizons]
+
+    pool = multiprocessing.Pool(None, data.init_fault_worker, (faultpath,))
+    results = []
+    update('Inverting: ')
+    for i, result in enumerate(pool.imap(_sweep_horizon, horizons)):
+        update('%i ' % (len(horizons) - i))
+        results.append(result)
+    update('\n')
+    pool.close()
+    pool.join()
+
+    slips, misfits = zip(*results)
+    return np.array(slips), np.array(misfits)
+
+def _sweep_horizon(xyz):
+    """Inverts `xyz` at each shear angle, warm-starting each inversion with the
+    previous solution."""
+    fault = data.columns2xyz(data.fault_columns())
+    slips, misfits = [], []
+    guess = (0, 0)
+    for alpha in alphas:
+        slip, metric = invert(fault, xyz, alpha, guess)
+        slips.append(slip)
+        misfits.append(metric)
+        guess = slip
+    return slips, misfits
+
+def _invert_task(args):
+    xyz, alpha, guess = args
+    fault = data.columns2xyz(data.fault_columns())
+    return invert(fault, xyz, alpha, guess)
+
+def invert(fault, xyz, alpha, guess=(0, 0)):
+    return utilities.invert_slip(fault, xyz, alpha, guess=guess, overlap_thresh=1,
+                       return_metric=True)
 
 def update(text):
     sys.stdout.write(str(text))
     sys.stdout.flush()
 
-optimize_single_alpha()
-#optimize_individual_alpha()
+if __name__ == '__main__':
+    optimize_single_alpha()
+    #optimize_individual_alpha()
+    #fit_single_alpha()
@@ -1,47 +1,153 @@
+import multiprocessing
+
 import numpy as np
 import matplotlib.pyplot as plt
+import matplotlib.tri as mtri
 
 import geoprobe
 
-from fault_kinematics.homogeneous_simple_shear import _Shear, invert_slip
+from fault_kinematics.homogeneous_simple_shear import _Shear
+import utilities
 import data
 
 
+def main(adaptive=False):
+    hor = data.horizons[0]
+    fault = data.world_xyz(data.fault)
+    xyz = utilities.decimated_xyz(hor, 2500)
+
+    alpha = data.alpha
+
+    planar_var = planar_variance(xyz)
+    slip, thresh = utilities.invert_slip(fault, xyz, alpha=alpha, return_metric=True)
+    print planar_var, thresh
+
+    dx, dy = slip
+    width = 2000
+    height = 2000
+    pool = roughness_pool(fault, xyz, alpha)
+
+    if adaptive:
+        x, y, roughness, cells = adaptive_roughness(slip, pool, 1.1 * thresh,
+                                                    width, height)
+        plot_adaptive(x, y, roughness, 1.1 * thresh)
+    else:
+        xx, yy = np.mgrid[dx-width:dx+width:100, dy-height:dy+height:100]
+        slips = np.column_stack([xx.ravel(), yy.ravel()])
+        roughness = batch_roughness(slips, pool).reshape(xx.shape)
+        roughness = np.ma.masked_greater(roughness, 1.1 * thresh)
+        plt.pcolormesh(xx, yy, roughness)
+    pool.close()
+    pool.join()
+
+    plt.plot(dx, dy, 'ro')
+    plt.colorbar()
+    plt.axis('tight')
+    plt.axis('equal')
+    plt.show()
+
 def planar_variance(xyz):
     vecs, vals = geoprobe.utilities.principal_axes(*xyz.T, return_eigvals=True)
     return vals[-1]
 
-hor = data.horizons[0]
-fault = data.to_world(data.to_xyz(data.fault))
-xyz = data.to_xyz(hor)[::100]
-xyz = data.to_world(xyz)
+def roughness_pool(fault, xyz, alpha, overlap_thresh=0.1, processes=None):
+    """
+    A process pool for ``batch_roughness``. Each worker sets up the misfit
+    function for restoring `xyz` along `fault` once, and reuses it for every
+    slip vector it evaluates.
+    """
+    return multiprocessing.Pool(processes, _init_roughness,
+                                (fault, xyz, alpha, overlap_thresh))
+
+def batch_roughness(slips, pool, chunksize=64):
+    """
+    Evaluates the misfit ("roughness") of the restored horizon for each slip
+    vector in an Mx2 array of `slips`. The slips are evaluated in chunks of
+    `chunksize` by a `pool` created with ``roughness_pool``.
+
+    Returns an M-length array of misfits.
+    """
+    slips = np.atleast_2d(slips)
+    chunks = [slips[i:i+chunksize] for i in range(0, len(slips), chunksize)]
+    return np.hstack(pool.map(_roughness_chunk, chunks, chunksize=1))
+
+def adaptive_roughness(center, pool, cutoff, width=2000, height=2000,
+                       spacing=400, levels=4, max_gradient=None):
+    """
+    Maps the misfit around the slip vector `center` on a quadtree. Starts
+    with cells of size `spacing` and splits a cell into quarters (up to
+    `levels` times) if the misfit at any of its corners is below `cutoff` or
+    if the misfit changes faster than `max_gradient` across it. Misfits are
+    evaluated with ``batch_roughness`` and each corner is evaluated once.
 
-alpha = data.alpha
+    Returns:
+    --------
+        x, y : Arrays of the slip vectors where the misfit was evaluated.
+        roughness : An array of the misfit at each x, y.
+        cells : An Nx3 array of the xmin, ymin, and size of each leaf cell.
+    """
+    unit = float(spacing) / 2**levels
+    size = 2**levels
+    origin = np.asarray(center, dtype=np.float64) - [width, height]
+    nx = int(np.ceil(2.0 * width / spacing))
+    ny = int(np.ceil(2.0 * height / spacing))
 
-func = _Shear(fault, xyz, alpha=alpha, overlap_thresh=0.1)
+    # Cells and corners are in integer multiples of the finest spacing
+    cells = [(i * size, j * size, size) for i in range(nx) for j in range(ny)]
+    values, leaves = {}, []
+    while cells:
+        corners = set()
+        for cell in cells:
+            corners.update(_corners(cell))
+        new = sorted(corners.difference(values))
+        if new:
+            misfits = batch_roughness(origin + unit * np.array(new), pool)
+            values.update(zip(new, misfits))
 
-planar_var = planar_variance(xyz)
-slip, thresh = invert_slip(fault, xyz, alpha=alpha, return_metric=True)
-print planar_var, thresh
+        refined = []
+        for cell in cells:
+            i, j, n = cell
+            vals = [values[corner] for corner in _corners(cell)]
+            steep = (max_gradient is not None and
+                     (max(vals) - min(vals)) / (n * unit) > max_gradient)
+            if n > 1 and (min(vals) < cutoff or steep):
+                n //= 2
+                refined.extend([(i, j, n), (i + n, j, n),
+                                (i, j + n, n), (i + n, j + n, n)])
+            else:
+                leaves.append(cell)
+        cells = refined
 
+    keys = sorted(values)
+    x, y = (origin + unit * np.array(keys, dtype=np.float64)).T
+    roughness = np.array([values[key] for key in keys])
+    cells = np.array(leaves, dtype=np.float64) * unit
+    cells[:,:2] += origin
+    return x, y, roughness, cells
 
-dx, dy = slip
-width = 2000
-height = 2000
-xx, yy = np.mgrid[dx-width:dx+width:100, dy-height:dy+height:100]
-roughness = np.zeros(xx.shape, dtype=np.float)
+def _corners(cell):
+    i, j, n = cell
+    return [(i, j), (i + n, j), (i, j + n), (i + n, j + n)]
 
-for i, j in np.ndindex(xx.shape):
-    roughness[i,j] = func((xx[i,j],yy[i,j]))
-roughness = np.ma.masked_greater(roughness, 1.1 * thresh)
+def plot_adaptive(x, y, roughness, cutoff, ax=None):
+    """Plots an irregularly sampled misfit surface (e.g. from
+    ``adaptive_roughness``), masking areas with misfits above `cutoff`."""
+    if ax is None:
+        ax = plt.gca()
+    tri = mtri.Triangulation(x, y)
+    tri.set_mask(np.any(roughness[tri.triangles] > cutoff, axis=1))
+    return ax.tripcolor(tri, roughness, shading='gouraud')
 
-flat_point = np.unravel_index(roughness.argmin(), roughness.shape)
-plt.pcolormesh(xx, yy, roughness)
-plt.plot(dx, dy, 'ro')
-plt.colorbar()
-plt.axis('tight')
-plt.axis('equal')
-plt.show()
+# The misfit function for each worker process (see ``_init_roughness``)
+_roughness = {}
 
+def _init_roughness(fault, xyz, alpha, overlap_thresh):
+    _roughness['func'] = _Shear(fault, xyz, alpha=alpha,
+                                overlap_thresh=overlap_thresh)
 
+def _roughness_chunk(slips):
+    func = _roughness['func']
+    return np.array([func(slip) for slip in slips], dtype=np.float64)
 
+if __name__ == '__main__':
+    main()
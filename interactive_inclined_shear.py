@@ -100,7 +100,7 @@ def triangles(fault):
 if __name__ == '__main__':
     fault = geoprobe.swfault('/data/nankai/data/swFaults/jdk_oos_splay_large_area_depth.swf')
     hor = data.horizons[0]
-    horxyz = data.to_world(data.to_xyz(hor))[::100]
+    horxyz = data.world_xyz(hor)[::100]
 
     plot = FaultModel(fault, horxyz)
     plot.configure_traits()
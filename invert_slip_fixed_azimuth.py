@@ -5,8 +5,8 @@ specified azimuth.
 import numpy as np
 import matplotlib.pyplot as plt
 
-from fault_kinematics.homogeneous_simple_shear import invert_slip
 import data
+import utilities
 import basic
 
 def main():
@@ -23,7 +23,7 @@ def forced_direction_inversion(azimuth, fault, xyz, alpha, **kwargs):
     azimuth = np.radians(90 - azimuth)
     dx, dy = np.cos(azimuth), np.sin(azimuth)
     direc = [[dx, dy], [dx, dy]]
-    return invert_slip(fault, xyz, alpha, direc=direc, **kwargs)
+    return utilities.invert_slip(fault, xyz, alpha, direc=direc, **kwargs)
 
 
 if __name__ == '__main__':
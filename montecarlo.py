@@ -0,0 +1,155 @@
+"""
+Engines for propagating uncertainties through the shortening budget in
+``shortening_calculations``.
+
+Each input to the budget is a named quantity (e.g. the plate motion rate) with
+a nominal value and a 2 sigma error. ``UfloatEngine`` represents inputs as
+``uncertainties.ufloat`` quantities and propagates errors linearly (this is
+what's used in the paper). ``MonteCarlo`` instead represents each input as a
+large array of random samples, so non-Gaussian inputs, "hard" bounds and
+non-linear quantities (e.g. ratios) are handled correctly. The budget is then
+evaluated with vectorized numpy expressions over all samples at once.
+
+For example::
+
+    import shortening_calculations as calc
+    from montecarlo import MonteCarlo
+
+    engine = MonteCarlo(numsamples=10**6)
+    print engine.describe(calc.seaward_percentage(engine))
+"""
+import numpy as np
+import scipy.special
+from uncertainties import ufloat
+
+import utilities
+
+class UfloatEngine(object):
+    """
+    Linear error propagation using ``uncertainties.ufloat``. Errors are 2
+    sigma. Each call returns a new (independent) ufloat, and "hard" bounds
+    are ignored.
+    """
+    def normal(self, name, nominal, error, hard_min=None, hard_max=None):
+        """A normally distributed input with a 2 sigma `error`."""
+        return ufloat(nominal, error)
+
+    def uniform(self, name, low, high):
+        """An input equally likely to be anywhere between `low` and `high`."""
+        two_sigma = 2 * (high - low) / np.sqrt(12)
+        return ufloat(0.5 * (low + high), two_sigma)
+
+    def constant(self, name, value):
+        """An input without any uncertainty."""
+        return value
+
+    def empirical(self, name, samples, value):
+        """An input with an empirical distribution (e.g. bootstrap results).
+        `samples` and `value` are functions that return the samples or a
+        ufloat, respectively. This engine only calls `value`."""
+        return value()
+
+    def min_value(self, value):
+        """Minimum of the 2 sigma confidence interval."""
+        return utilities.min_value(value)
+
+    def max_value(self, value):
+        """Maximum of the 2 sigma confidence interval."""
+        return utilities.max_value(value)
+
+    def describe(self, value):
+        return str(value)
+
+
+class MonteCarlo(object):
+    """
+    Propagates uncertainties by representing each input as `numsamples`
+    random samples. Inputs with the same name share the same samples, so
+    quantities that depend on the same input (e.g. the plate rate) are
+    correctly correlated.
+
+    Parameters:
+    -----------
+        numsamples : The number of samples of each input.
+        seed : The seed for the random number generator.
+    """
+    def __init__(self, numsamples=10**6, seed=None):
+        self.numsamples = numsamples
+        self.rng = np.random.RandomState(seed)
+        self.inputs = {}
+
+    def _input(self, name, draw):
+        if name not in self.inputs:
+            self.inputs[name] = draw()
+        return self.inputs[name]
+
+    def _nominal(self, name, value):
+        """The nominal value to use for input `name` (subclasses may override
+        the default `value`)."""
+        return value
+
+    def normal(self, name, nominal, error, hard_min=None, hard_max=None):
+        """
+        A normally distributed input with a 2 sigma `error`. If `hard_min`
+        and/or `hard_max` are given, the distribution is truncated to them
+        (so a nominal value close to a bound has a mean pulled away from it).
+        Raises a ValueError if the nominal value is outside the bounds.
+        """
+        nominal = self._nominal(name, nominal)
+        if ((hard_min is not None and np.any(nominal < hard_min)) or
+            (hard_max is not None and np.any(nominal > hard_max))):
+            raise ValueError('The nominal value of %s is outside of its hard '
+                             'bounds' % name)
+        sigma = 0.5 * error
+        def draw():
+            lower, upper = 0.0, 1.0
+            if hard_min is not None:
+                lower = scipy.special.ndtr((hard_min - nominal) / sigma)
+            if hard_max is not None:
+                upper = scipy.special.ndtr((hard_max - nominal) / sigma)
+            # Inverse transform sampling between the bounds
+            quantiles = self.rng.uniform(0, 1, self.numsamples)
+            quantiles = lower + (upper - lower) * quantiles
+            return nominal + sigma * scipy.special.ndtri(quantiles)
+        return self._input(name, draw)
+
+    def uniform(self, name, low, high):
+        """An input equally likely to be anywhere between `low` and `high`."""
+        center = 0.5 * (low + high)
+        offset = self._nominal(name, center) - center
+        def draw():
+            return offset + self.rng.uniform(low, high, self.numsamples)
+        return self._input(name, draw)
+
+    def constant(self, name, value):
+        """An input without any uncertainty."""
+        return self._nominal(name, value)
+
+    def empirical(self, name, samples, value):
+        """An input with an empirical distribution. `samples` is a function
+        that returns the observed values, which are resampled with
+        replacement. (`value` is only used by ``UfloatEngine``.)"""
+        def draw():
+            observed = np.asarray(samples(), dtype=np.float64)
+            mean = observed.mean()
+            offset = self._nominal(name, mean) - mean
+            idx = self.rng.randint(0, len(observed), self.numsamples)
+            return offset + observed[idx]
+        return self._input(name, draw)
+
+    def min_value(self, value):
+        """The 2.5th percentile (c.f. ``utilities.min_value``)."""
+        return np.percentile(value, 2.5, axis=-1)
+
+    def max_value(self, value):
+        """The 97.5th percentile (c.f. ``utilities.max_value``)."""
+        return np.percentile(value, 97.5, axis=-1)
+
+    def summary(self, value):
+        """A ufloat with the mean and 2 standard deviations of `value`."""
+        return ufloat(np.mean(value), 2 * np.std(value))
+
+    def describe(self, value):
+        low, median, high = np.percentile(value, [2.5, 50, 97.5])
+        return '%s (median %0.3g, 95%% interval %0.3g to %0.3g)' % (
+                    self.summary(value), median, low, high)
@@ -3,7 +3,7 @@ import matplotlib.pyplot as plt
 
 import utilities
 import data
-from process_bootstrap_results import get_result
+from process_bootstrap_results import get_result, session
 
 def main():
     fig, ax = plt.subplots()
@@ -12,16 +12,27 @@ def main():
 
     offsets = [[0, 0]]
     heaves = [[0,0,0]]
+    pool = utilities.heave_pool()
 
     for hor, name in zip(data.horizons[::-1], data.gulick_names[::-1]):
-        results = get_result(hor.name)
-        discarded = 200 - results.shape[0]
+        stats = session().running_stats(hor.name)
+        discarded = session().num_runs[hor.name] - stats.count
         print 'Discarded {} points from {}'.format(discarded, hor.name)
 
         # Plot covariance ellipse...
-        dx, dy, slip = plot(ax, results, '# ' + name)
+        dx, dy, slip = plot(ax, stats.mean, stats.cov, '# ' + name)
         offsets.append([dx, dy])
-        heaves.append(utilities.calculate_heave([dx, dy], hor))
+
+        # Heave and its uncertainty over all of the bootstrap runs
+        calculator = utilities.HeaveCalculator(hor)
+        _, heave, heave_cov = calculator.distribution(get_result(hor.name), 
+                                                      pool)
+        heaves.append(heave)
+        utilities.plot_error_ellipse(heave_cov[:2,:2], heave[:2], ax=ax, 
+                                     nstd=2, alpha=0.5, color='green')
+
+    pool.close()
+    pool.join()
 
 
     # Plot plate motion over 200kyr
@@ -39,12 +50,8 @@ def main():
 
     plt.show()
 
-def plot(ax, results, name=None):
-    mean = results.mean(axis=0)
-    cov = np.cov(results, rowvar=False)
-    dx, dy = results.mean(axis=0)
-
-    #ax.plot(*results.T, marker='o', ls='none')
+def plot(ax, mean, cov, name=None):
+    dx, dy = mean
 
     # Plot an error ellipse around the mean offset
     utilities.plot_error_ellipse(cov, mean, ax=ax, nstd=2, alpha=0.5)
@@ -56,7 +56,7 @@ def forearc_plot():
 
     # Shortening from fault kinematics is in meters...
     landward_shortening = shortening_parallel_to_section() / 1000
-    min_bound = heave_parallel_to_section() / 1000
+    min_bound = heave_parallel_to_section().nominal_value / 1000
 
     total_oost = calc.oost_shortening()
 
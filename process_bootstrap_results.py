@@ -1,3 +1,6 @@
+import argparse
+import hashlib
+
 import h5py
 import numpy as np
 import matplotlib.pyplot as plt
@@ -6,6 +9,13 @@ import data
 
 from uncertainties import ufloat
 
+# If True, the functions in this module read the bootstrap results in chunks
+# instead of all at once (see ``BootstrapResults``).
+streaming = False
+
+# Version of the layout of the "Summary" group (see ``write_summary``)
+summary_version = 1
+
 def main():
     print 'Total Shortening (km)'
     print shortening_magnitude() / 1000.0
@@ -20,7 +30,7 @@ def main():
     print shortening_azimuth()
 
     print 'Total heave (km)'
-    print np.linalg.norm(heave()) / 1000.0
+    print heave_magnitude() / 1000.0
 
     print 'Heave parallel to section... (km)'
     print heave_parallel_to_section()/ 1000.0
@@ -28,77 +38,299 @@ def main():
     print 'Heave perpendicular to section... (km)'
     print heave_perp_to_section() / 1000.0
 
-def bootstrap_results():
-    f, group = load()
-
+class BootstrapResults(object):
+    """
+    The bootstrap results in `filename`. Each horizon's runs are read and
+    filtered (see ``get_result``) once when first needed, and derived
+    statistics are calculated when first needed and then cached. Up-to-date
+    summaries stored in the file (see ``write_summary``) are used instead of
+    the runs wherever possible. ``num_runs`` maps each horizon name to the
+    number of runs stored for it (including outliers).
+
+    If `streaming` is True, the runs are instead read `chunksize` at a time
+    (see ``iter_result``) whenever statistics are calculated, so memory use
+    doesn't depend on the number of runs. The outlier threshold for each
+    horizon is only calculated once.
+    """
     # Use all the trial runs from horizons 7 & 8 to get an average shortening
     # and estimate error.
     names = ['jdk_forearc_horizon_7', 'jdk_forearc_horizon_6', 
              'jdk_forearc_horizon_5', 'jdk_forearc_horizon_4']
 
-    results = np.vstack([get_result(name, group) for name in names])
+    def __init__(self, filename='bootstrap.hdf5', streaming=False,
+                 chunksize=2**16):
+        self.filename = filename
+        self.streaming = streaming
+        self.chunksize = chunksize
+        f = h5py.File(filename, 'r')
+        group = f['IndependentBootstrap']
+        self.horizon_names = [name for name in group if 'slip' in group[name]]
+        self.num_runs = dict((name, completed_runs(group[name]))
+                             for name in self.horizon_names)
+        self._summaries = {}
+        for name in self.horizon_names:
+            summary = read_summary(f, name)
+            if summary is not None:
+                self._summaries[name] = summary
+        f.close()
+        self._results = {}
+        self._cache = {}
+
+    def _cached(self, key, func):
+        if key not in self._cache:
+            self._cache[key] = func()
+        return self._cache[key]
+
+    def result(self, name):
+        """The (filtered) runs for horizon `name`."""
+        if name not in self._results:
+            f, group = load(self.filename)
+            self._results[name] = get_result(name, group)
+            f.close()
+        return self._results[name]
+
+    def iter_results(self, name):
+        """Yields the (filtered) runs for horizon `name` in chunks."""
+        if not self.streaming:
+            yield self.result(name)
+            return
+        f = h5py.File(self.filename, 'r')
+        try:
+            hor_group = f['IndependentBootstrap'][name]
+            # The median and MAD of the variances only need to be found once
+            is_outlier = self._cached(('is_outlier', name),
+                    lambda: outlier_filter(hor_group, self.chunksize))
+            for chunk in iter_result(hor_group, self.chunksize, is_outlier):
+                yield chunk
+        finally:
+            f.close()
+
+    def bootstrap_results(self):
+        """All of the runs for the horizons in ``names``. (Note that this
+        reads them all into memory, even when streaming.)"""
+        def stack():
+            return np.vstack([chunk for name in self.names
+                                    for chunk in self.iter_results(name)])
+        return self._cached('bootstrap_results', stack)
+
+    def running_stats(self, name):
+        """A ``utilities.RunningStats`` of the slip for horizon `name`."""
+        def stats():
+            if name in self._summaries:
+                return self._summaries[name]
+            running = utilities.RunningStats(2)
+            for chunk in self.iter_results(name):
+                running.update(chunk)
+            return running
+        return self._cached(('running_stats', name), stats)
+
+    def mean_cov(self, name):
+        """Mean and covariance of the slip for horizon `name`."""
+        stats = self.running_stats(name)
+        return stats.mean, stats.cov
+
+    def azimuth(self, name):
+        """Azimuth of the mean slip for horizon `name`."""
+        def calc():
+            mean, cov = self.mean_cov(name)
+            return azimuth(mean)
+        return self._cached(('azimuth', name), calc)
+
+    def total_shortening(self):
+        """Mean and covariance of all runs in ``bootstrap_results``."""
+        def stats():
+            running = utilities.RunningStats(2)
+            for name in self.names:
+                running.merge(self.running_stats(name))
+            return running.mean, running.cov
+        return self._cached('total_shortening', stats)
+
+    def total_heave(self):
+        """Mean and covariance of the horizontal heave of the oldest horizon
+        over all runs in ``bootstrap_results``."""
+        def stats():
+            pool = utilities.heave_pool()
+            calculator = utilities.HeaveCalculator(data.horizons[0])
+            running = utilities.RunningStats(2)
+            for name in self.names:
+                for chunk in self.iter_results(name):
+                    running.update(calculator.heaves(chunk, pool)[:,:2])
+            pool.close()
+            pool.join()
+            return running.mean, running.cov
+        return self._cached('total_heave', stats)
+
+    def projected(self, quantity, direction):
+        """`quantity` ("shortening" or "heave") projected onto `direction`,
+        with a 2-sigma error."""
+        def calc():
+            if quantity == 'shortening':
+                mean, cov = self.total_shortening()
+            else:
+                mean, cov = self.total_heave()
+            return _parallel_to_vector(mean, cov, np.asarray(direction))
+        return self._cached(('projected', quantity, tuple(direction)), calc)
+
+@data.memoize
+def session():
+    """The ``BootstrapResults`` for "bootstrap.hdf5", shared by the functions
+    in this module."""
+    return BootstrapResults(streaming=streaming)
 
-    f.close()
-    return results
+def bootstrap_results():
+    return session().bootstrap_results()
 
 def get_result(name, group=None):
     """Get the subset of the bootstrap results where the inversion converged."""
     if group is None:
-        f, dat = load()
-    else:
-        dat = group
+        return session().result(name)
 
-    slips = dat[name]['slip'].value
-    var = dat[name]['variance'].value
+    # Only use runs that were completely written (see bootstrap_error.py)
+    hor_group = group[name]
+    completed = completed_runs(hor_group)
+    slips = hor_group['slip'][:completed]
+    var = hor_group['variance'][:completed]
 
     # Remove results where the resulting variance is an outlier...
     mask = ~utilities.is_outlier(var)
+    return slips[mask]
 
-    if group is None:
+def completed_runs(hor_group):
+    """The number of runs that were completely written to `hor_group` (see
+    bootstrap_error.py), including any outliers."""
+    return hor_group.attrs.get('completed', hor_group['slip'].shape[0])
+
+def iter_result(hor_group, chunksize=2**16, is_outlier=None):
+    """
+    Like ``get_result``, but yields the runs in `hor_group` in chunks of (at
+    most) `chunksize` runs. The outlier filter (see ``outlier_filter``) is
+    calculated exactly, but with a few passes over the variances in chunks
+    instead of reading them all at once. Pass in an `is_outlier` function
+    from an earlier call to ``outlier_filter`` to skip those passes.
+    """
+    if is_outlier is None:
+        is_outlier = outlier_filter(hor_group, chunksize)
+    completed = completed_runs(hor_group)
+    for start in range(0, completed, chunksize):
+        stop = min(start + chunksize, completed)
+        var = hor_group['variance'][start:stop]
+        yield hor_group['slip'][start:stop][~is_outlier(var)]
+
+def outlier_filter(hor_group, chunksize=2**16):
+    """Returns a function that flags the outliers in a chunk of variances
+    from `hor_group` (see ``utilities.streaming_is_outlier``)."""
+    completed = completed_runs(hor_group)
+    def variances():
+        for start in range(0, completed, chunksize):
+            stop = min(start + chunksize, completed)
+            yield hor_group['variance'][start:stop]
+    return utilities.streaming_is_outlier(variances)
+
+def summary_fingerprint(hor_group):
+    """Identifies the runs in `hor_group` and the parameters they were run
+    with. Changes whenever runs are added (see ``write_summary``)."""
+    attrs = hor_group.parent.attrs
+    items = [hor_group['slip'].shape, hor_group.attrs.get('completed'),
+             hor_group.attrs.get('first_run')]
+    items += [attrs.get(name) for name in ['alpha', 'fault', 'seed', 
+                                           'numsamples']]
+    items = [np.asarray(item).tolist() for item in items]
+    return hashlib.md5(repr(items).encode('utf-8')).hexdigest()
+
+def write_summary(f, chunksize=2**16):
+    """
+    Stores the number of runs kept, mean and covariance of the slip, azimuth
+    and slip parallel to the section (see ``section_unit_vector``) for each
+    horizon in the "Summary" group of an open bootstrap file `f`. Summaries
+    that are already up to date are left alone.
+    """
+    if f.get('Summary') is not None:
+        if f['Summary'].attrs.get('version') != summary_version:
+            del f['Summary']
+    summary = f.require_group('Summary')
+    summary.attrs['version'] = summary_version
+
+    group = f['IndependentBootstrap']
+    for name, hor_group in group.items():
+        if 'slip' not in hor_group or read_summary(f, name) is not None:
+            continue
+        stats = utilities.RunningStats(2)
+        for chunk in iter_result(hor_group, chunksize):
+            stats.update(chunk)
+        parallel = _parallel_to_vector(stats.mean, stats.cov, 
+                                       section_unit_vector())
+
+        hor_summary = summary.require_group(name)
+        hor_summary.attrs['count'] = stats.count
+        hor_summary.attrs['mean'] = stats.mean
+        hor_summary.attrs['cov'] = stats.cov
+        hor_summary.attrs['azimuth'] = azimuth(stats.mean)
+        hor_summary.attrs['parallel_to_section'] = parallel.nominal_value
+        hor_summary.attrs['parallel_to_section_error'] = parallel.std_dev
+        hor_summary.attrs['fingerprint'] = summary_fingerprint(hor_group)
+
+def summarize(filename='bootstrap.hdf5'):
+    """Writes (or updates) the "Summary" group of an existing bootstrap file,
+    e.g. one written before summaries were stored."""
+    f = h5py.File(filename, 'a')
+    try:
+        write_summary(f)
+    finally:
         f.close()
 
-    return slips[mask]
+def read_summary(f, name):
+    """
+    The stored summary of horizon `name` in an open bootstrap file `f` as a
+    ``utilities.RunningStats``, or None if there isn't an up-to-date one.
+    """
+    summary = f.get('Summary')
+    if summary is None or summary.attrs.get('version') != summary_version:
+        return None
+    hor_summary = summary.get(name)
+    hor_group = f['IndependentBootstrap'].get(name)
+    if hor_summary is None or hor_group is None:
+        return None
+    if hor_summary.attrs.get('fingerprint') != summary_fingerprint(hor_group):
+        return None
+    attrs = hor_summary.attrs
+    return utilities.RunningStats.from_moments(attrs['count'], attrs['mean'],
+                                               attrs['cov'])
 
 def recent_offset():
-    results = get_result('jdk_forearc_gulick_3-a')
-
-    mean = results.mean(axis=0)
-    cov = np.cov(results, rowvar=False)
+    mean, cov = session().mean_cov('jdk_forearc_gulick_3-a')
 
     slip_vec = mean / np.linalg.norm(mean)
     azimuth = 90 - np.degrees(np.arctan2(*slip_vec[::-1])) + 360
 
     return np.linalg.norm(mean), error(slip_vec, cov), azimuth
 
-def load():
-    f = h5py.File('bootstrap.hdf5', 'r')
+def load(filename='bootstrap.hdf5'):
+    f = h5py.File(filename, 'r')
     group = f['IndependentBootstrap']
     return f, group
 
 def total_shortening():
-    results = bootstrap_results()
+    return session().total_shortening()
 
-    # Mean and covariance for error...
-    mean = results.mean(axis=0)
-    cov = np.cov(results, rowvar=False)
-    return mean, cov
+def total_heave():
+    return session().total_heave()
 
 def heave():
-    results = bootstrap_results()
-    slip = results.mean(axis=0)
+    mean, cov = total_heave()
+    return mean
 
-    offset = utilities.calculate_heave(slip, data.horizons[0])
-    return offset[:2]
+def heave_magnitude():
+    mean, cov = total_heave()
+    heave_dir = mean / np.linalg.norm(mean)
+    return ufloat(np.linalg.norm(mean), error(heave_dir, cov))
 
 def heave_parallel_to_section():
-    full_heave = heave()
     section = section_unit_vector()
-    return full_heave.dot(section)
+    return session().projected('heave', section)
 
 def heave_perp_to_section():
-    full_heave = heave()
     direc = _perp_vector(section_unit_vector())
-    return full_heave.dot(direc)
+    return session().projected('heave', direc)
 
 def section_unit_vector():
     angle = np.radians(330 - 180)
@@ -114,14 +346,12 @@ def _perp_vector(direction):
     return np.cross([dx, dy, 0], [0, 0, 1])[:2]
 
 def shortening_parallel_to_section():
-    mean, cov = total_shortening()
     direc = section_unit_vector()
-    return _parallel_to_vector(mean, cov, direc)
+    return session().projected('shortening', direc)
 
 def shortening_perp_to_section():
-    mean, cov = total_shortening()
     direc = _perp_vector(section_unit_vector())
-    return _parallel_to_vector(mean, cov, direc)
+    return session().projected('shortening', direc)
 
 
 def shortening_magnitude():
@@ -150,16 +380,23 @@ def error(direction, cov):
     return 2 * std
 
 def all_results():
-    f, group = load()
-    results = [get_result(hor.name, group) for hor in data.horizons]
-    f.close()
-    return results
+    return [get_result(hor.name) for hor in data.horizons]
 
 def mean_slip_vectors():
-    return [item.mean(axis=0) for item in all_results()]
+    return [session().mean_cov(hor.name)[0] for hor in data.horizons]
 
 def azimuths():
-    return [azimuth(item) for item in mean_slip_vectors()]
+    return [session().azimuth(hor.name) for hor in data.horizons]
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(
+        description='Prints the shortening estimated from bootstrap.hdf5.')
+    parser.add_argument('--summarize', nargs='*', metavar='FILE',
+                        help='Store summary statistics in each bootstrap file '
+                             '(default: bootstrap.hdf5) instead')
+    args = parser.parse_args()
+    if args.summarize is not None:
+        for filename in args.summarize or ['bootstrap.hdf5']:
+            summarize(filename)
+    else:
+        main()
@@ -1,3 +1,7 @@
+import os
+import shutil
+import tempfile
+
 import geoprobe
 import data
 import utilities
@@ -6,24 +10,32 @@ from fault_kinematics import homogeneous_simple_shear
 
 from process_bootstrap_results import get_result, load
 
-fault = data.to_world(data.to_xyz(data.fault))
+fault = data.world_xyz(data.fault)
 alpha = data.alpha
 
 f, group = load()
 
 for hor in data.horizons:
     print hor.name
-    xyz = data.to_world(data.to_xyz(hor))
+    xyz = data.world_xyz(hor)
 
     slip = get_result(hor.name, group)
 
     restored = homogeneous_simple_shear.inclined_shear(fault, xyz, slip, alpha)
 
     print 'Resampling...'
-    restored = data.to_model(restored)
-    restored = utilities.grid_xyz(restored)
-    new_hor = geoprobe.horizon(*restored.T)
-    new_hor.write('restored_horizons/' + hor.name + '.hzn')
+    restored = data.to_model(restored, out=restored)
+
+    # Grid one tile at a time, streaming the results to disk
+    tmpdir = tempfile.mkdtemp(dir='restored_horizons')
+    try:
+        path = os.path.join(tmpdir, hor.name + '.cols')
+        data.write_columns(path, utilities.iter_grid_xyz(restored, workers=-1))
+        new_hor = geoprobe.horizon(*data.open_columns(path))
+        new_hor.write('restored_horizons/' + hor.name + '.hzn')
+        del new_hor
+    finally:
+        shutil.rmtree(tmpdir)
 
 f.close()
 
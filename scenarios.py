@@ -0,0 +1,186 @@
+"""
+Sensitivity of the shortening budget (see ``shortening_calculations``) to
+alternative values of its inputs.
+
+A set of scenarios assigns nominal values to any of the named inputs of the
+budget (e.g. "age", "plate_motion", "restored_length"; see the names passed to
+the engine in ``shortening_calculations``). Inputs that a scenario doesn't set
+keep their usual values. All scenarios are evaluated at once with Monte Carlo
+error propagation (see ``ScenarioEngine``) and the results are written to a
+"tidy" csv file with one row per scenario and output quantity.
+
+For example, to vary the age and plate motion rate on a full grid::
+
+    values = factorial(age=[1.95, 2.1, 2.3, 2.512],
+                       plate_motion=np.linspace(38, 48, 21))
+    write_csv('scenarios.csv', sweep(values))
+
+Or to compare a few named scenarios::
+
+    names, values = named([('Strasser', {}),
+                           ('Young', {'age': 1.95}),
+                           ('Slow', {'plate_motion': 40.0, 'age': 2.512})])
+    write_csv('scenarios.csv', sweep(values, names))
+"""
+import csv
+import itertools
+
+import numpy as np
+
+import shortening_calculations as calc
+from montecarlo import MonteCarlo
+
+# The budget quantities evaluated for each scenario by default
+outputs = ['bed_length_shortening', 'total_convergence', 'oost_shortening',
+           'seaward_shortening', 'total_oost_percentage', 'seaward_percentage',
+           'landward_percentage']
+
+def main():
+    values = factorial(age=np.linspace(1.95, 2.512, 9),
+                       plate_motion=np.linspace(38, 48, 11),
+                       restored_length=np.linspace(72, 92, 11))
+    table = sweep(values)
+    write_csv('scenarios.csv', table)
+    print 'Wrote %i rows to scenarios.csv' % len(table['scenario'])
+
+class ScenarioEngine(MonteCarlo):
+    """
+    A ``montecarlo.MonteCarlo`` engine that evaluates many scenarios at once.
+    `values` is a dict of input name --> an array of nominal values with one
+    item per scenario (NaN uses the input's usual value). Each input is then
+    a numscenarios x `numsamples` array.
+
+    The same random draws are used for every scenario, so differences
+    between scenarios aren't obscured by sampling noise.
+
+    Nominal values have to lie within the "hard" bounds of an input (e.g. an
+    age between "min_age" and "max_age"), and values close to a bound are
+    pulled away from it by the truncation (e.g. an age of 1.95 has a mean of
+    about 2.03). The bounds are inputs too, so a scenario can move them.
+    """
+    def __init__(self, values, numsamples=1000, seed=None):
+        MonteCarlo.__init__(self, numsamples, seed)
+        self.values = dict((name, np.asarray(value, dtype=np.float64))
+                           for name, value in values.items())
+        self.used = set()
+        lengths = set(len(value) for value in self.values.values())
+        if len(lengths) > 1:
+            raise ValueError('All inputs need one value per scenario.')
+        self.numscenarios = lengths.pop() if lengths else 1
+
+    def _nominal(self, name, value):
+        if name not in self.values:
+            return value
+        self.used.add(name)
+        values = self.values[name]
+        return np.where(np.isnan(values), value, values)[:,None]
+
+    def unused(self):
+        """The names in `values` that haven't been used by any input."""
+        return sorted(set(self.values) - self.used)
+
+    def table(self, value):
+        """`value` as a numscenarios x numsamples array."""
+        return np.zeros((self.numscenarios, 1)) + value
+
+def factorial(**values):
+    """
+    A full factorial grid of scenarios for the given input name --> sequence
+    of values. Returns a dict of input name --> an array with one value per
+    scenario (see ``ScenarioEngine``).
+    """
+    names = sorted(values)
+    grid = np.meshgrid(*[values[name] for name in names], indexing='ij')
+    return dict((name, item.ravel()) for name, item in zip(names, grid))
+
+def named(scenarios):
+    """
+    Scenarios from a sequence of (scenario name, dict of input name -->
+    value) pairs. Inputs a scenario doesn't set keep their usual values.
+
+    Returns:
+    --------
+        names : A list of the scenario names.
+        values : A dict of input name --> an array with one value per
+            scenario (see ``ScenarioEngine``).
+    """
+    names = [name for name, _ in scenarios]
+    inputs = set(itertools.chain(*[params.keys() for _, params in scenarios]))
+    values = {}
+    for key in inputs:
+        values[key] = np.array([params.get(key, np.nan)
+                                for _, params in scenarios], dtype=np.float64)
+    return names, values
+
+def sweep(values, names=None, quantities=None, numsamples=1000, seed=None):
+    """
+    Evaluates the shortening budget for each scenario in `values` (see
+    ``factorial`` and ``named``). Raises a ValueError if an input in `values`
+    isn't used by any of the `quantities` (e.g. a misspelled name).
+
+    Parameters:
+    -----------
+        values : A dict of input name --> an array with one value per
+            scenario.
+        names : An optional sequence of names for the scenarios. (Scenarios
+            are numbered by default.)
+        quantities : A list of the names of the functions in
+            ``shortening_calculations`` to evaluate. Defaults to ``outputs``.
+        numsamples : The number of Monte Carlo samples per scenario.
+        seed : The seed for the random number generator.
+
+    Returns:
+    --------
+        table : A dict of column name --> array, with one row per scenario
+            and quantity. Columns are "scenario", each input in `values`,
+            "quantity", "mean", "error" (2 sigma), and the "median",
+            "p2.5", and "p97.5" percentiles.
+    """
+    if quantities is None:
+        quantities = outputs
+    engine = ScenarioEngine(values, numsamples, seed)
+    if names is None:
+        names = np.arange(engine.numscenarios)
+    inputs = sorted(values)
+
+    columns = ['scenario'] + inputs + ['quantity', 'mean', 'error', 'median',
+                                       'p2.5', 'p97.5']
+    table = dict((column, []) for column in columns)
+    for quantity in quantities:
+        result = getattr(calc, quantity)(engine)
+        if isinstance(result, tuple):
+            # e.g. total_convergence also returns "hard" bounds
+            result = result[0]
+        result = engine.table(result)
+
+        table['scenario'].append(names)
+        for name in inputs:
+            table[name].append(values[name])
+        table['quantity'].append([quantity] * engine.numscenarios)
+        table['mean'].append(result.mean(axis=1))
+        table['error'].append(2 * result.std(axis=1))
+        low, median, high = np.percentile(result, [2.5, 50, 97.5], axis=1)
+        table['median'].append(median)
+        table['p2.5'].append(low)
+        table['p97.5'].append(high)
+
+    # Catch typos and inputs that don't affect these quantities.
+    unused = engine.unused()
+    if unused:
+        raise ValueError('Unknown or unused inputs: %s' % ', '.join(unused))
+
+    table = dict((column, np.concatenate(table[column])) for column in columns)
+    table['columns'] = columns
+    return table
+
+def write_csv(filename, table):
+    """Writes a table from ``sweep`` to `filename` as csv."""
+    columns = table['columns']
+    with open(filename, 'wb') as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(columns)
+        for row in zip(*[table[column] for column in columns]):
+            writer.writerow(row)
+
+if __name__ == '__main__':
+    main()
@@ -2,13 +2,11 @@ import numpy as np
 import matplotlib.pyplot as plt
 
 from fault_kinematics.homogeneous_simple_shear import inclined_shear
-from fault_kinematics.homogeneous_simple_shear import invert_slip
 
 import data
 import utilities
 
-fault = data.to_xyz(data.fault)
-fault = data.to_world(fault)
+fault = data.world_xyz(data.fault)
 
 models = [[0, 0]]
 
@@ -16,8 +14,7 @@ i = 0
 for hor in data.horizons[::-1]:
     print hor.name
     # Downsample horizon for faster solution...
-    xyz = data.to_xyz(hor)[::50,:]
-    xyz = data.to_world(xyz)
+    xyz = utilities.decimated_xyz(hor)
 
     # Move this horizon to the last horizon's best fit offset.
     # Following the path of all previous horizons...
@@ -25,7 +22,7 @@ for hor in data.horizons[::-1]:
         dx, dy = model
         xyz = inclined_shear(fault, xyz, (dx,dy), data.alpha)
 
-    model = invert_slip(fault, xyz, data.alpha, guess=(0,0))
+    model = utilities.invert_slip(fault, xyz, data.alpha, guess=(0,0))
     models.append(model)
     i += 1
 
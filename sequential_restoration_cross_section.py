@@ -6,6 +6,7 @@ import geoprobe
 from fault_kinematics.homogeneous_simple_shear import inclined_shear
 
 import data
+import utilities
 import process_bootstrap_results
 
 class Section(object):
@@ -40,7 +41,7 @@ def plot_horizons(ax, horizons, slip=(0,0)):
 
     ax.set_ylim([-8, -1.5])
     for hor in horizons:
-        xyz = data.world_xyz(hor)[::100]
+        xyz = utilities.decimated_xyz(hor)
         xyz = inclined_shear(fault, xyz, slip, data.alpha)
         sec.plot(xyz, ax)
 
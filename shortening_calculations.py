@@ -1,45 +1,61 @@
-from uncertainties import ufloat
-from utilities import min_value, max_value
+"""
+The shortening budget of the outer wedge. Each function takes an optional
+uncertainty `engine` (see ``montecarlo.py``). By default, errors are
+propagated linearly with ``uncertainties.ufloat`` (``UfloatEngine``) and
+results are ufloats with 2 sigma errors. With a ``montecarlo.MonteCarlo``
+engine, results are arrays of samples instead.
+"""
+from montecarlo import UfloatEngine
+
+def main(engine=None):
+    engine = get_engine(engine)
 
-def main():
     print 'Plate motion rate parallel to section'
-    print plate_motion()
+    print engine.describe(plate_motion(engine))
 
     print 'Shortening (including ductile) from bed-length'
-    print bed_length_shortening()
+    print engine.describe(bed_length_shortening(engine))
 
     print 'Estimated total shortening accomodated by OOSTS'
-    print oost_shortening()
+    print engine.describe(oost_shortening(engine))
 
     print 'Shortening accommodated by seaward branch of OOSTS'
-    print seaward_shortening()
+    print engine.describe(seaward_shortening(engine))
 
     print 'Percentage of OOST shortening'
-    print total_oost_percentage()
+    print engine.describe(total_oost_percentage(engine))
 
     print 'Landward Percentage'
-    print landward_percentage()
+    print engine.describe(landward_percentage(engine))
 
     print 'Seaward Percentage'
-    print seaward_percentage()
+    print engine.describe(seaward_percentage(engine))
 
-def bed_length_balancing():
+def get_engine(engine=None):
+    """The uncertainty engine to use (``UfloatEngine`` by default)."""
+    if engine is None:
+        engine = UfloatEngine()
+    return engine
+
+def bed_length_balancing(engine=None):
     """Summed fault heaves from bed-length balancing."""
-    present_length = 32
+    engine = get_engine(engine)
+    present_length = engine.constant('present_length', 32)
 
     # 2km error from range in restored pin lines + 10% interpretation error
-    restored_length = ufloat(82, 10)
+    restored_length = engine.normal('restored_length', 82, 10)
 
     shortening = restored_length - present_length
     return shortening
 
-def bed_length_shortening():
+def bed_length_shortening(engine=None):
     """Shortening estimate including volume loss."""
-    alpha = ufloat(0.35, 0.1)
-    heaves = bed_length_balancing()
+    engine = get_engine(engine)
+    alpha = engine.normal('volume_loss', 0.35, 0.1)
+    heaves = bed_length_balancing(engine)
     return heaves * (1 + alpha)
 
-def age():
+def age(engine=None):
     """
     Age of the oldest in-sequence structures from Strasser, 2009.
     
@@ -49,16 +65,17 @@ def age():
         min_age : The "hard" minimum from Strasser, et al, 2009
         max_age : The "hard" maximum from Strasser, et al, 2009
     """
-    min_age = 1.95 # Ma
-    max_age = 2.512 # Ma
+    engine = get_engine(engine)
+    min_age = engine.constant('min_age', 1.95) # Ma
+    max_age = engine.constant('max_age', 2.512) # Ma
 
     # Strasser perfers an older age within this range, so we model this as
     # 2.3 +/- 0.2, but provide mins and maxs
-    avg_age = ufloat(2.3, 0.2) # Ma
+    avg_age = engine.normal('age', 2.3, 0.2, min_age, max_age) # Ma
 
     return avg_age, min_age, max_age
 
-def plate_motion():
+def plate_motion(engine=None):
     """
     Plate motion rate (forearc relative to oceanic plate) _parallel_ _to_
     _section_ (Not full plate vector!) based on elastic block modeling 
@@ -72,10 +89,11 @@ def plate_motion():
     # for details of derivation... Uses block segment nearest study area instead
     # of derived euler pole.
     # I'm assuming that Loveless's reported errors are 2 sigma...
-    section_parallel_rate = ufloat(42.9, 2.1)
+    engine = get_engine(engine)
+    section_parallel_rate = engine.normal('plate_motion', 42.9, 2.1)
     return section_parallel_rate
 
-def total_convergence():
+def total_convergence(engine=None):
     """
     Total shortening parallel to section from plate motion and ages.
     
@@ -88,16 +106,17 @@ def total_convergence():
         max_shortening : A "hard" maximum using the uncertainty in the plate 
             motion and maximum constraints on the age.
     """
-    avg_age, min_age, max_age = age()
-    rate = plate_motion()
+    engine = get_engine(engine)
+    avg_age, min_age, max_age = age(engine)
+    rate = plate_motion(engine)
 
     shortening = rate * avg_age
 
-    min_shortening = min_value(min_age * rate)
-    max_shortening = max_value(max_age * rate)
+    min_shortening = engine.min_value(min_age * rate)
+    max_shortening = engine.max_value(max_age * rate)
     return shortening, min_shortening, max_shortening
 
-def oost_shortening():
+def oost_shortening(engine=None):
     """
     Shortening on the out-of-sequence thrust system based on integrated plate
     convergence minus the shortening predicted in the outer wedge from line
@@ -107,10 +126,31 @@ def oost_shortening():
     --------
         shortening : A ufloat with a 2 sigma error estimate
     """
-    total_shortening, min_total, max_total = total_convergence()
-    return total_shortening - bed_length_shortening()
+    total_shortening, min_total, max_total = total_convergence(engine)
+    return total_shortening - bed_length_shortening(engine)
+
+def landward_shortening(engine=None):
+    """
+    Shortening parallel to section on the landward branch of the OOSTS from
+    the bootstrapped restoration of the forearc horizons.
+
+    Returns:
+    --------
+        shortening : a ufloat with 2 sigma error in kilometers.
+    """
+    import process_bootstrap_results as bootstrap
+
+    def value():
+        return bootstrap.shortening_parallel_to_section() / 1000
+
+    def samples():
+        section = bootstrap.section_unit_vector()
+        return bootstrap.bootstrap_results().dot(section) / 1000
+
+    engine = get_engine(engine)
+    return engine.empirical('landward_shortening', samples, value)
 
-def seaward_shortening():
+def seaward_shortening(engine=None):
     """Shortening accomodated on the seaward branch of the OOSTS based on 
     comparing the total (`oost_shortening()`) shortening with the shortening
     predicted on the landward branch from forearc uplift. 
@@ -119,11 +159,9 @@ def seaward_shortening():
     --------
         shortening : a ufloat with 2 sigma error in kilometers.
     """
-    from process_bootstrap_results import shortening_parallel_to_section
-    landward_shortening = shortening_parallel_to_section() / 1000
-    return oost_shortening() - landward_shortening
+    return oost_shortening(engine) - landward_shortening(engine)
 
-def total_oost_percentage():
+def total_oost_percentage(engine=None):
     """
     Percentage of shortening accommdated by out-of-sequence thrusting during
     the development of the present-day outer wedge.
@@ -133,10 +171,10 @@ def total_oost_percentage():
         percentage : A ufloat with a 2 sigma error representing a unitless 
             ratio (e.g. multiply by 100 to get percentage).
     """
-    total_shortening, min_total, max_total = total_convergence()
-    return oost_shortening() / total_shortening
+    total_shortening, min_total, max_total = total_convergence(engine)
+    return oost_shortening(engine) / total_shortening
 
-def seaward_percentage():
+def seaward_percentage(engine=None):
     """
     Percentage of total plate convergence accomodated by the seaward branch of
     the OOSTS during its period of activity.
@@ -147,12 +185,14 @@ def seaward_percentage():
             ratio (e.g. multiply by 100 to get percentage).
     """
     # Duration in myr from Strasser, 2009
-    duration = 1.95 - 1.24 
-    rate = plate_motion()
+    engine = get_engine(engine)
+    duration = (engine.constant('seaward_start', 1.95) 
+                - engine.constant('seaward_end', 1.24))
+    rate = plate_motion(engine)
     total = duration * rate
-    return seaward_shortening() / total
+    return seaward_shortening(engine) / total
 
-def landward_percentage():
+def landward_percentage(engine=None):
     """
     Maximum percentage of total plate convergence accomodated by the landward
     branch of the OOSTS during its period of activity.
@@ -162,13 +202,14 @@ def landward_percentage():
         percentage : A ufloat with a 2 sigma error representing a unitless 
             ratio (e.g. multiply by 100 to get percentage).
     """
-    from process_bootstrap_results import shortening_parallel_to_section
-    landward_shortening = shortening_parallel_to_section() / 1000
+    engine = get_engine(engine)
+    landward = landward_shortening(engine)
 
-    duration = ufloat(0.97, 0.07) - ufloat(0.25, 0.25)
-    rate = plate_motion()
+    duration = (engine.normal('landward_start', 0.97, 0.07) 
+                - engine.normal('landward_end', 0.25, 0.25))
+    rate = plate_motion(engine)
     total = duration * rate
-    return landward_shortening / total
+    return landward / total
 
 if __name__ == '__main__':
     main()
@@ -1,11 +1,23 @@
+import os
+import hashlib
+import multiprocessing
+
 import numpy as np
 from matplotlib.patches import Ellipse
 import matplotlib.pyplot as plt
 import geoprobe
 
+import fault_kinematics
 from fault_kinematics import homogeneous_simple_shear
 import data
 
+# Results of ``invert_slip`` are cached here. The least recently used results
+# are removed once the total size exceeds ``inversion_cache_size`` bytes.
+inversion_cachedir = os.path.join(data.cachedir, 'inversions')
+inversion_cache_size = 16 * 2**20
+# Part of every cache key. Bump it if the cached results change meaning.
+inversion_cache_version = 1
+
 def shortening_along_section(mean, cov):
     """Calculates shortening and error projected onto an inline in the 3D 
     seismic volume. Returns shortening parallel to the line and error parallel
@@ -120,25 +132,173 @@ def plot_plate_motion(ax=None, xy=(0, 0), time=1, ellipkwargs=None,
 def calculate_heave(slip, hor):
     """Calculates the average heave resulting from moving the given horizon
     (`hor`) by `slip` along the main fault."""
-    orig_xyz = data.world_xyz(hor)[::50]
-    fault = data.world_xyz(data.fault)
+    return HeaveCalculator(hor).heave(slip)
 
+class HeaveCalculator(object):
+    """
+    Calculates the average heave resulting from moving a horizon along the
+    main fault by each of many slip vectors (e.g. every bootstrap run). The
+    decimated horizon is prepared once and reused for each slip.
+
+    Parameters:
+    -----------
+        hor : The horizon to move.
+        alpha : The shear angle in degrees. Defaults to ``data.alpha``.
+        numpoints : The number of points the horizon is decimated to.
+    """
+    def __init__(self, hor, alpha=None, numpoints=5000):
+        if alpha is None:
+            alpha = data.alpha
+        self.alpha = alpha
+        self.xyz = decimated_xyz(hor, numpoints)
+
+    def heave(self, slip):
+        """The average x, y, z heave for a single slip vector."""
+        return _heave(data.fault_xyz, self.xyz, slip, self.alpha)
+
+    def heaves(self, slips, pool=None, chunksize=16):
+        """
+        An Nx3 array of the average heave for each of an Nx2 array of slips.
+        If a `pool` (see ``heave_pool``) is given, the slips are evaluated in
+        parallel in chunks of `chunksize`.
+        """
+        slips = np.atleast_2d(slips)
+        if pool is None or len(slips) == 0:
+            heaves = [self.heave(slip) for slip in slips]
+            return np.array(heaves, dtype=np.float64).reshape(-1, 3)
+        chunks = [(self.xyz, self.alpha, slips[i:i+chunksize])
+                  for i in range(0, len(slips), chunksize)]
+        return np.vstack(pool.map(_heave_chunk, chunks, chunksize=1))
+
+    def distribution(self, slips, pool=None):
+        """
+        The distribution of heaves for an Nx2 array of slips.
+
+        Returns:
+        --------
+            heaves : An Nx3 array of heaves (see ``heaves``).
+            mean : The mean x, y, z heave.
+            cov : The 3x3 covariance matrix of the heaves.
+        """
+        heaves = self.heaves(slips, pool)
+        return heaves, heaves.mean(axis=0), np.cov(heaves, rowvar=False)
+
+def heave_pool(processes=None):
+    """A process pool for ``HeaveCalculator.heaves``. Each worker memory-maps
+    the fault once (see ``data.init_fault_worker``)."""
+    faultpath = data.world_columns(data.fault)
+    return multiprocessing.Pool(processes, data.init_fault_worker, (faultpath,))
+
+def _heave_chunk(args):
+    xyz, alpha, slips = args
+    fault = data.columns2xyz(data.fault_columns())
+    return np.array([_heave(fault, xyz, slip, alpha) for slip in slips],
+                    dtype=np.float64).reshape(-1, 3)
+
+def _heave(fault, orig_xyz, slip, alpha):
     func = homogeneous_simple_shear.inclined_shear
-    moved_xyz = func(fault, orig_xyz, slip, data.alpha, remove_invalid=False)
+    moved_xyz = func(fault, orig_xyz, slip, alpha, remove_invalid=False)
 
     diff = moved_xyz - orig_xyz
     mask = np.isfinite(diff)
     mask = mask[:,0] & mask[:,1]
     return diff[mask,:].mean(axis=0)
 
-def grid_xyz(xyz):
+def invert_slip(fault, xyz, alpha=0, return_metric=False, **kwargs):
+    """
+    A drop-in replacement for ``homogeneous_simple_shear.invert_slip`` that
+    caches its results on disk (in ``inversion_cachedir``). Results are keyed
+    by a hash of the input arrays, all other arguments and the installed
+    ``fault_kinematics`` version (see ``inversion_key``), so re-running a
+    script with the same inputs doesn't re-invert anything.
     """
-    Resamples points onto a regular grid with a spacing of 1. This is intended
-    for resampling a seismic horizon, thus the dx and dy are fixed at 1.
+    key = inversion_key(fault, xyz, alpha, **kwargs)
+    filename = os.path.join(inversion_cachedir, key + '.npy')
+    try:
+        result = np.load(filename)
+        # Mark as recently used
+        os.utime(filename, None)
+    except (IOError, OSError, ValueError):
+        func = homogeneous_simple_shear.invert_slip
+        slip, metric = func(fault, xyz, alpha, return_metric=True, **kwargs)
+        result = np.append(slip, metric)
+        data.save_atomic(filename, result)
+        _evict(inversion_cachedir, inversion_cache_size)
+
+    slip, metric = result[:2], result[2]
+    if return_metric:
+        return slip, metric
+    return slip
+
+def inversion_key(fault, xyz, alpha, **kwargs):
+    """A hash of the arguments to ``invert_slip`` and of the versions of
+    the cache and of ``fault_kinematics``. Numeric arguments are compared by
+    value (so e.g. ``1`` and ``1.0`` match) and anything else by ``repr``."""
+    md5 = hashlib.md5()
+    versions = (inversion_cache_version, fault_kinematics_version())
+    md5.update(repr(versions).encode('utf-8'))
+    for arr in [fault, xyz]:
+        arr = np.ascontiguousarray(arr, dtype=np.float64)
+        md5.update(repr(arr.shape).encode('utf-8'))
+        md5.update(arr.tobytes())
+    params = [('alpha', alpha)] + sorted(kwargs.items())
+    for name, value in params:
+        if value is not None and not isinstance(value, basestring):
+            try:
+                value = np.asarray(value, dtype=np.float64).tolist()
+            except (TypeError, ValueError):
+                pass
+        md5.update(repr((name, value)).encode('utf-8'))
+    return md5.hexdigest()
+
+@data.memoize
+def fault_kinematics_version():
+    """The installed version of ``fault_kinematics`` (or None if unknown)."""
+    fallback = getattr(fault_kinematics, '__version__', None)
+    try:
+        import pkg_resources
+    except ImportError:
+        return fallback
+    try:
+        return pkg_resources.get_distribution('fault_kinematics').version
+    except pkg_resources.DistributionNotFound:
+        return fallback
+
+def _evict(dirname, maxsize):
+    """Removes the least recently modified files in `dirname` until their
+    total size is below `maxsize` bytes."""
+    files = []
+    for name in os.listdir(dirname):
+        path = os.path.join(dirname, name)
+        try:
+            info = os.stat(path)
+        except OSError:
+            continue
+        files.append((info.st_mtime, info.st_size, path))
+
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= maxsize:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            # Another process may have removed it already
+            pass
+        total -= size
+
+def grid_xyz(xyz, spacing=1, workers=1):
+    """
+    Resamples points onto a regular grid. This is intended for resampling a
+    seismic horizon, thus the dx and dy default to 1. Grid nodes farther than
+    2 * `spacing` from any input point are left out.
 
     Parameters:
     -----------
         xyz : An Nx3 array of points
+        spacing : The grid spacing in x and y.
+        workers : The number of processes used to query the nearest points
+            (-1 uses all cpus).
 
     Returns:
     --------
@@ -146,23 +306,162 @@ def grid_xyz(xyz):
     """
     import scipy.spatial
     tree = scipy.spatial.cKDTree(xyz[:,:2])
+    xnodes, ynodes = _grid_nodes(xyz, spacing)
+    return _snap(tree, xyz, xnodes, ynodes, spacing, workers)
 
+def iter_grid_xyz(xyz, spacing=1, tilesize=512, workers=1):
+    """
+    Resamples points onto a regular grid one tile at a time (see
+    ``grid_xyz``). Only `tilesize` x `tilesize` grid nodes are held in memory
+    at once, and tiles that contain no input points are skipped.
+
+    Parameters:
+    -----------
+        xyz : An Nx3 array of points
+        spacing : The grid spacing in x and y.
+        tilesize : The number of grid nodes along each side of a tile.
+        workers : The number of processes used to query the nearest points
+            (-1 uses all cpus).
+
+    Yields:
+    -------
+        resampled_xyz : An Mx3 array of the grid points within each tile.
+    """
+    import scipy.spatial
+    tree = scipy.spatial.cKDTree(xyz[:,:2])
+    xnodes, ynodes = _grid_nodes(xyz, spacing)
+
+    ntiles = (-(-len(xnodes) // tilesize), -(-len(ynodes) // tilesize))
+    occupied = _occupied_tiles(xyz, (xnodes[0], ynodes[0]), ntiles,
+                               tilesize * spacing, 2 * spacing)
+    for i, j in np.argwhere(occupied).tolist():
+        xtile = xnodes[i*tilesize:(i+1)*tilesize]
+        ytile = ynodes[j*tilesize:(j+1)*tilesize]
+        resampled = _snap(tree, xyz, xtile, ytile, spacing, workers)
+        if len(resampled):
+            yield resampled
+
+def _occupied_tiles(xyz, origin, ntiles, width, reach, chunksize=2**20):
+    """
+    A boolean array of shape `ntiles` that's True for each tile (of size
+    `width`, starting at `origin`) with grid nodes within `reach` of a point
+    in `xyz`. The points are processed `chunksize` at a time so that only
+    small temporary arrays are needed.
+    """
+    occupied = np.zeros(ntiles, dtype=bool)
+    origin = np.asarray(origin, dtype=np.float64)
+
+    # Offsets across the square within `reach` of a point, no more than a
+    # tile apart so that no tile in between is skipped.
+    steps = np.linspace(-reach, reach, int(np.ceil(2.0 * reach / width)) + 1)
+    offsets = [(dx, dy) for dx in steps for dy in steps]
+
+    for start in range(0, len(xyz), chunksize):
+        chunk = xyz[start:start+chunksize, :2]
+        for offset in offsets:
+            shifted = chunk + np.array(offset)
+            i, j = np.floor((shifted - origin) / width).astype(int).T
+            inside = (i >= 0) & (i < ntiles[0]) & (j >= 0) & (j < ntiles[1])
+            occupied[i[inside], j[inside]] = True
+    return occupied
+
+def _grid_nodes(xyz, spacing):
+    """The x and y coordinates of the grid nodes covering `xyz`."""
     x, y, z = xyz.T
     xmin, xmax = int(x.min()), int(x.max()+1)
     ymin, ymax = int(y.min()), int(y.max()+1)
+    return np.arange(xmin, xmax, spacing), np.arange(ymin, ymax, spacing)
+
+def _snap(tree, xyz, xnodes, ynodes, spacing, workers):
+    """The z-value of the nearest point in `xyz` at each grid node within
+    2 * `spacing` of a point. (`tree` is a cKDTree of xyz[:,:2].)"""
+    xx, yy = np.meshgrid(xnodes, ynodes, indexing='ij')
+    nodes = np.column_stack([xx.ravel(), yy.ravel()])
+
+    dist, idx = _query(tree, nodes, eps=2, distance_upper_bound=2*spacing,
+                       workers=workers)
+    mask = np.isfinite(dist)
+    return np.column_stack([nodes[mask], xyz[idx[mask], 2]])
+
+def _query(tree, points, workers=1, **kwargs):
+    """Nearest-neighbor ``cKDTree.query`` using `workers` processes. (Older
+    versions of scipy call this argument ``n_jobs``.)"""
+    try:
+        return tree.query(points, k=1, workers=workers, **kwargs)
+    except TypeError:
+        return tree.query(points, k=1, n_jobs=workers, **kwargs)
+
+def decimate(xyz, numpoints=5000):
+    """
+    Downsamples points to (at most) `numpoints` points with even coverage in
+    map view. The points are binned onto a regular grid with a cell size
+    chosen so that about `numpoints` cells are occupied, and the point closest
+    to the center of each cell is kept. The result is deterministic and does
+    not depend on the order of the input points.
 
-    xx, yy = np.mgrid[xmin:xmax, ymin:ymax]
-    zz = np.empty(xx.shape, dtype=np.float)
-    zz.fill(np.nan)
+    Parameters:
+    -----------
+        xyz : An Nx3 array of points
+        numpoints : The number of points to return.
 
-    for i, j in np.ndindex(xx.shape):
-        dist, idx = tree.query([xx[i,j], yy[i,j]], k=1, eps=2, 
-                            distance_upper_bound=2)
-        if np.isfinite(dist):
-            zz[i, j] = xyz[idx,2]
-    mask = np.isfinite(zz)
-    return np.vstack([xx[mask], yy[mask], zz[mask]]).T
+    Returns:
+    --------
+        decimated_xyz : A `numpoints`x3 array of points (in the same order
+            as they occur in `xyz`). If `xyz` has fewer than `numpoints`
+            points, `xyz` is returned unchanged.
+    """
+    xyz = np.asarray(xyz)
+    if xyz.shape[0] <= numpoints:
+        return xyz
+    return xyz[_decimate_indices(xyz, numpoints)]
 
+def decimated_xyz(hor, numpoints=5000):
+    """
+    Same as ``decimate(data.world_xyz(hor), numpoints)``, but the indices of
+    the points that are kept are cached on disk alongside the world
+    coordinates of `hor` (see ``data.cached_derived``), so each horizon is
+    only decimated once.
+    """
+    xyz = data.world_xyz(hor)
+    if xyz.shape[0] <= numpoints:
+        return xyz
+    idx = data.cached_derived(hor, 'decimate%i' % numpoints,
+                              lambda: _decimate_indices(xyz, numpoints))
+    return xyz[idx]
+
+def _decimate_indices(xyz, numpoints):
+    """The sorted indices of the points ``decimate`` keeps."""
+    x, y = xyz[:,0], xyz[:,1]
+    xmin, ymin = x.min(), y.min()
+    width, height = np.ptp(x), np.ptp(y)
+    area = max(width * height, width**2, height**2)
+    if area == 0:
+        return np.arange(numpoints)
+
+    # Start with the cell size that would give `numpoints` cells if the points
+    # filled their bounding box, and shrink it until enough cells are occupied.
+    cellsize = np.sqrt(area / numpoints)
+    for _ in range(50):
+        i = np.floor((x - xmin) / cellsize).astype(np.int64)
+        j = np.floor((y - ymin) / cellsize).astype(np.int64)
+        cell = i * (j.max() + 1) + j
+        numcells = np.unique(cell).size
+        if numcells >= numpoints:
+            break
+        cellsize *= 0.95 * np.sqrt(float(numcells) / numpoints)
+
+    # Keep the point nearest the center of each cell...
+    dist = ((x - xmin) / cellsize - i - 0.5)**2 + ((y - ymin) / cellsize - j - 0.5)**2
+    order = np.lexsort((dist, cell))
+    cell = cell[order]
+    first = np.ones(cell.size, dtype=bool)
+    first[1:] = cell[1:] != cell[:-1]
+    idx = order[first]
+
+    # ...and evenly thin the occupied cells down to the budget.
+    if idx.size > numpoints:
+        idx = idx[np.linspace(0, idx.size - 1, numpoints).astype(int)]
+    return np.sort(idx)
 
 def is_outlier(points, thresh=3.5):
     """
@@ -197,6 +496,137 @@ def is_outlier(points, thresh=3.5):
 
     return modified_z_score > thresh
 
+def streaming_median(chunks, numbins=4096, maxcollect=2**20):
+    """
+    The exact median (as in ``np.median``) of a set of values too large to
+    hold in memory at once. `chunks` is a function that returns an iterable
+    of 1D arrays of the values and is called once per pass over the data.
+    (See ``streaming_order_statistic``.)
+    """
+    count = 0
+    for chunk in chunks():
+        count += np.size(chunk)
+    if count == 0:
+        return np.nan
+    ranks = sorted(set([(count - 1) // 2, count // 2]))
+    values = [streaming_order_statistic(chunks, rank, numbins, maxcollect)
+              for rank in ranks]
+    return np.mean(values)
+
+def streaming_order_statistic(chunks, rank, numbins=4096, maxcollect=2**20):
+    """
+    The `rank`th smallest (starting from 0) of the values returned by
+    `chunks` (see ``streaming_median``). Each pass histograms the values in
+    the current window into `numbins` bins and narrows the window to the
+    values in the bin containing `rank`. Once at most `maxcollect` values are
+    left in the window, they are read into memory and selected exactly.
+    """
+    lo, hi = np.inf, -np.inf
+    for chunk in chunks():
+        if np.size(chunk):
+            lo, hi = min(lo, np.min(chunk)), max(hi, np.max(chunk))
+
+    # Number of values less than lo
+    below = 0
+    while lo < hi:
+        counts = np.zeros(numbins, dtype=np.int64)
+        mins = np.empty(numbins)
+        mins.fill(np.inf)
+        maxs = np.empty(numbins)
+        maxs.fill(-np.inf)
+        for chunk in chunks():
+            chunk = np.asarray(chunk, dtype=np.float64).ravel()
+            chunk = chunk[(chunk >= lo) & (chunk <= hi)]
+            idx = ((chunk - lo) / (hi - lo) * numbins).astype(int)
+            idx = np.minimum(idx, numbins - 1)
+            counts += np.bincount(idx, minlength=numbins)
+            np.minimum.at(mins, idx, chunk)
+            np.maximum.at(maxs, idx, chunk)
+
+        if counts.sum() <= maxcollect:
+            window = [chunk[(chunk >= lo) & (chunk <= hi)]
+                      for chunk in map(np.ravel, chunks())]
+            window = np.concatenate(window)
+            return np.partition(window, rank - below)[rank - below]
+
+        # The bin containing `rank` holds exactly the values in the new window
+        cumulative = counts.cumsum()
+        i = np.searchsorted(cumulative, rank - below, side='right')
+        below += cumulative[i] - counts[i]
+        lo, hi = mins[i], maxs[i]
+    return lo
+
+def streaming_is_outlier(chunks, thresh=3.5):
+    """
+    Like ``is_outlier`` for a 1D set of values too large to hold in memory at
+    once (see ``streaming_median``). Returns a function that returns a
+    boolean array with True for the outliers in a chunk of values.
+    """
+    median = streaming_median(chunks)
+    def deviations():
+        for chunk in chunks():
+            yield np.abs(chunk - median)
+    med_abs_deviation = streaming_median(deviations)
+
+    def is_outlier(chunk):
+        diff = np.abs(chunk - median)
+        modified_z_score = 0.6745 * diff / med_abs_deviation
+        return modified_z_score > thresh
+    return is_outlier
+
+class RunningStats(object):
+    """
+    Accumulates the mean and covariance of numdimensions-length observations
+    one chunk at a time with a numerically stable single-pass update (Chan et
+    al., 1979). Accumulators can also be combined with ``merge``.
+    """
+    def __init__(self, ndim=2):
+        self.count = 0
+        self.mean = np.zeros(ndim)
+        self._m2 = np.zeros((ndim, ndim))
+
+    @classmethod
+    def from_moments(cls, count, mean, cov):
+        """A ``RunningStats`` of `count` observations with the given mean and
+        covariance (e.g. a stored summary)."""
+        mean = np.asarray(mean, dtype=np.float64)
+        stats = cls(mean.size)
+        stats.count = int(count)
+        stats.mean = mean
+        if count > 1:
+            stats._m2 = np.asarray(cov, dtype=np.float64) * (count - 1)
+        return stats
+
+    def update(self, points):
+        """Adds a numobservations by numdimensions array of observations."""
+        points = np.asarray(points, dtype=np.float64)
+        if len(points) == 0:
+            return self
+        other = RunningStats(self.mean.size)
+        other.count = len(points)
+        other.mean = points.mean(axis=0)
+        diff = points - other.mean
+        other._m2 = diff.T.dot(diff)
+        return self.merge(other)
+
+    def merge(self, other):
+        """Adds the observations accumulated by another ``RunningStats``."""
+        count = self.count + other.count
+        if other.count == 0:
+            return self
+        delta = other.mean - self.mean
+        weight = float(other.count) / count
+        self._m2 = (self._m2 + other._m2 
+                    + np.outer(delta, delta) * self.count * weight)
+        self.mean = self.mean + delta * weight
+        self.count = count
+        return self
+
+    @property
+    def cov(self):
+        """The sample covariance (as in ``np.cov``)."""
+        return self._m2 / (self.count - 1)
+
 def min_value(uncert_val):
     """Minimum confidence interval for a ufloat quantity."""
     return uncert_val.nominal_value - uncert_val.std_dev
@@ -1,20 +1,20 @@
 import numpy as np
 
 import geoprobe
-from fault_kinematics.homogeneous_simple_shear import invert_slip
 
 import data
+import utilities
 from interactive_inclined_shear import FaultModel
 
 
 def main():
     fault = geoprobe.swfault('/data/nankai/data/swFaults/jdk_oos_splay_large_area_depth.swf')
 
-    faultxyz = data.to_world(data.to_xyz(data.fault))
+    faultxyz = data.world_xyz(data.fault)
 
-    horxyz = data.to_world(data.to_xyz(data.horizons[0]))[::100]
+    horxyz = utilities.decimated_xyz(data.horizons[0])
 
-    slip = invert_slip(faultxyz, horxyz, alpha=data.alpha)
+    slip = utilities.invert_slip(faultxyz, horxyz, alpha=data.alpha)
 
     azimuth = np.degrees(np.arctan2(*slip[::-1]))
     azimuth = 90 - azimuth